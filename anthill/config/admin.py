@@ -2,32 +2,61 @@
 import anthill.common.admin as a
 
 from . model.apps import NoSuchApplicationError, NoSuchApplicationVersionError, ConfigApplicationError
-from . model.builds import NoSuchBuildError, ConfigBuildError
+from . model.builds import NoSuchBuildError, ConfigBuildError, BuildsModel
+from . model.targets import NoSuchDeploymentTargetError, DeploymentTargetError
+from . upload import BuildUploadError
+from . deploy import DeploymentJob
+from . loader import gather
 
 from anthill.common.environment import EnvironmentClient, AppNotFound
 from anthill.common.validate import validate
-from anthill.common.deployment import DeploymentMethods, DeploymentError
-from anthill.common.internal import Internal, InternalError
+from anthill.common.deployment import DeploymentMethods
+from anthill.common.options import options
 
-import tempfile
-import os
-import math
+
+def render_build_status(build):
+    if build.status == BuildsModel.STATUS_FAILED:
+        return a.status("Failed: {0}".format(build.error), "danger", "exclamation-triangle")
+
+    if build.status == BuildsModel.STATUS_DEPLOYING:
+        return a.status("Deploying (attempt {0})".format(build.attempts), "info", "refresh")
+
+    return a.status("Pending", "default", "clock-o")
+
+
+def render_builds_in_progress(controller="app", **context):
+    return a.links("Some builds are being deployed", [
+        a.link(controller, "Refresh", icon="refresh", **context)
+    ])
+
+
+def render_builds_pages(data, controller, **context):
+    pages = []
+
+    if data["newer_builds"]:
+        pages.append(a.link(controller, "Newer builds", icon="chevron-left", after=data["newer_builds"], **context))
+
+    if data["older_builds"]:
+        pages.append(a.link(controller, "Older builds", icon="chevron-right", before=data["older_builds"], **context))
+
+    if not pages:
+        return []
+
+    return [a.links("Pages", pages)]
 
 
 class DeployBuildController(a.UploadAdminController):
     def __init__(self, app, token):
         super(DeployBuildController, self).__init__(app, token)
         self.deployment = None
-        self.tmp_file = None
-        self.f = None
+        self.mirrors = None
+        self.upload = None
         self.build_id = None
         self.switch_default = None
 
     async def get(self, app_name):
-        environment_client = EnvironmentClient(self.application.cache)
-
         try:
-            app = await environment_client.get_app_info(app_name)
+            app = await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound as e:
             raise a.ActionError("App was not found.")
 
@@ -77,12 +106,11 @@ class DeployBuildController(a.UploadAdminController):
 
         self.switch_default = args.get("switch_default", False)
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
         builds = self.application.builds
 
         try:
-            await environment_client.get_app_info(app_name)
+            await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
@@ -99,127 +127,120 @@ class DeployBuildController(a.UploadAdminController):
         self.deployment = DeploymentMethods.get(deployment_method)()
         self.deployment.load(deployment_data)
 
-        self.tmp_file = tempfile.mkstemp()
-        sys_fd, key_path = self.tmp_file
-        self.f = open(key_path, "w")
+        try:
+            targets = await self.application.targets.list_targets(self.gamespace, app_name)
+        except DeploymentTargetError as e:
+            raise a.ActionError(e.message)
+
+        self.mirrors = {}
+
+        for target in targets:
+            mirror = DeploymentMethods.get(target.deployment_method)()
+            mirror.load(target.deployment_data)
+            self.mirrors[target.target_id] = mirror
 
         try:
             self.build_id = await builds.create_build(self.gamespace, app_name, comment, self.token.account)
         except ConfigBuildError as e:
             raise a.ActionError(e.message)
 
+        self.upload = self.application.deployments.receive(self.build_id, max_size=options.max_build_size)
+
     async def receive_completed(self):
         app_name = self.context.get("app_name")
 
-        if self.tmp_file and self.deployment and self.f and self.build_id:
-            sys_fd, key_path = self.tmp_file
-            self.f.close()
-
+        if self.upload and self.deployment and self.build_id:
             try:
-                builds = self.application.builds
+                await self.upload.complete()
+            except OSError as e:
+                await self.abort()
+                raise a.ActionError("Failed to store the configuration: {0}".format(str(e)))
 
-                try:
-                    url = await self.deployment.deploy(self.gamespace, key_path, app_name,
-                                                       str(self.gamespace) + "_" + str(self.build_id))
-                except DeploymentError as e:
-                    await builds.delete_build(self.gamespace, self.build_id)
-                    raise a.ActionError(e.message)
+            # the deployment itself may take a while, so it's done in background
+            self.application.deployments.put(DeploymentJob(
+                self.gamespace, app_name, self.build_id, self.deployment, self.upload,
+                mirrors=self.mirrors, switch_default=self.switch_default))
 
-                try:
-                    await builds.update_build_url(self.gamespace, self.build_id, app_name, url)
-                except ConfigBuildError as e:
-                    raise a.ActionError(e.message)
+            self.upload = None
 
-                if self.switch_default:
+            raise a.Redirect("app", message="Build has been uploaded and is being deployed", app_name=app_name)
 
-                    apps = self.application.apps
-                    try:
-                        await apps.update_default_build(self.gamespace, app_name, self.build_id)
-                    except ConfigApplicationError as e:
-                        raise a.Redirect("app",
-                                         message="Deployed, but failed to update default build: {0}".format(e.message),
-                                         app_name=app_name)
+    async def receive_data(self, chunk):
+        if not self.upload:
+            return
 
-            finally:
-                os.close(sys_fd)
+        try:
+            await self.upload.write(chunk)
+        except BuildUploadError as e:
+            await self.abort()
+            raise a.ActionError(e.message)
+        except OSError as e:
+            # a write on the executor has failed (say, the disk is full)
+            await self.abort()
+            raise a.ActionError("Failed to store the configuration: {0}".format(str(e)))
 
-            raise a.Redirect("app", message="Build has been deployed", app_name=app_name)
+    async def receive_aborted(self):
+        # the client has gone away in the middle of the upload (see handler.AdminUploadHandler)
+        await self.abort()
 
-    async def receive_data(self, chunk):
-        if self.f:
-            self.f.write(chunk)
+    async def abort(self):
+        if not self.upload:
+            return
+
+        self.upload = None
+        await self.application.deployments.abort(self.gamespace, self.build_id)
 
 
 class ApplicationController(a.AdminController):
     BUILDS_PER_PAGE = 10
 
-    @validate(app_name="str_name", build_page="int")
-    async def get(self, app_name, build_page=1):
+    @validate(app_name="str_name", before="int", after="int")
+    async def get(self, app_name, before=None, after=None):
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
         builds_data = self.application.builds
+        loader = self.application.admin_loader
 
+        async def get_application():
+            try:
+                return await apps.get_application(self.gamespace, app_name)
+            except NoSuchApplicationError:
+                return None
+
+        # none of these depend on each other
         try:
-            app = await environment_client.get_app_info(app_name)
+            app, app_settings, (builds, has_newer, has_older), builds_count, app_versions = await gather(
+                loader.get_app_info(app_name),
+                get_application(),
+                builds_data.list_builds_page(
+                    self.gamespace, app_name,
+                    limit=self.BUILDS_PER_PAGE,
+                    before=before, after=after),
+                builds_data.count_builds(self.gamespace, app_name),
+                apps.list_application_versions(self.gamespace, app_name))
         except AppNotFound:
             raise a.ActionError("App was not found.")
+        except (ConfigApplicationError, ConfigBuildError) as e:
+            raise a.ActionError(e.message)
 
         versions = app.versions
 
-        try:
-            app_settings = await apps.get_application(self.gamespace, app_name)
-        except NoSuchApplicationError:
-            app_settings = None
+        if app_settings is None:
             deployment_configured = False
             default_build = None
-        except ConfigApplicationError as e:
-            raise a.ActionError(e.message)
         else:
             deployment_configured = True
             default_build = app_settings.default_build
 
-        try:
-            build_items, builds = await builds_data.list_builds_pages(
-                self.gamespace, app_name,
-                limit=ApplicationController.BUILDS_PER_PAGE,
-                offset=(ApplicationController.BUILDS_PER_PAGE * (build_page - 1)))
-        except ConfigBuildError as e:
-            raise a.ActionError(e.message)
-
-        build_pages = int(math.ceil(float(build_items) / float(ApplicationController.BUILDS_PER_PAGE)))
+        author_names = await loader.get_author_names(self.gamespace, set(build.author for build in builds))
 
-        author_ids = set()
         for build in builds:
-            build.author_name = str(build.author)
-            author_ids.add(build.author)
-
-        internal = Internal()
-
-        try:
-            profiles = await internal.send_request(
-                "profile", "mass_profiles",
-                accounts=author_ids,
-                gamespace=self.gamespace,
-                action="get_public",
-                profile_fields=["name"])
-        except InternalError:
-            pass  # well
-        else:
-            for build in builds:
-                profile = profiles.get(str(build.author))
-                if profile:
-                    build.author_name = profile.get("name")
+            build.author_name = author_names[build.author]
 
-        try:
-            app_versions = await apps.list_application_versions(self.gamespace, app_name)
-        except ConfigApplicationError as e:
-            raise a.ActionError(e.message)
-        else:
-            version_builds = {
-                v.application_version: v
-                for v in app_versions
-            }
+        version_builds = {
+            v.application_version: v
+            for v in app_versions
+        }
 
         result = {
             "app_name": app_name,
@@ -231,7 +252,9 @@ class ApplicationController(a.AdminController):
             "app_settings": app_settings,
             "default_build": default_build,
             "version_builds": version_builds,
-            "build_pages": build_pages,
+            "builds_count": builds_count,
+            "newer_builds": builds[0].build_id if has_newer and builds else None,
+            "older_builds": builds[-1].build_id if has_older and builds else None,
             "default_build_title": "Build {0}".format(default_build) if default_build else "Unset",
         }
 
@@ -241,14 +264,23 @@ class ApplicationController(a.AdminController):
         app_name = self.context.get("app_name")
         build_id = self.context.get("build_id")
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
 
         try:
-            await environment_client.get_app_info(app_name)
+            await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
+        try:
+            build = await self.application.builds.get_build(self.gamespace, build_id)
+        except NoSuchBuildError:
+            raise a.ActionError("No such build")
+        except ConfigBuildError as e:
+            raise a.ActionError(e.message)
+
+        if not build.ready():
+            raise a.ActionError("Build {0} is not deployed yet".format(build_id))
+
         try:
             await apps.update_default_build(self.gamespace, app_name, build_id)
         except ConfigApplicationError as e:
@@ -261,11 +293,10 @@ class ApplicationController(a.AdminController):
     async def unset_default_configuration(self):
         app_name = self.context.get("app_name")
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
 
         try:
-            await environment_client.get_app_info(app_name)
+            await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
@@ -316,8 +347,11 @@ class ApplicationController(a.AdminController):
                                                 "Therefore, if not set per application version, users would not "
                                                 "be able to download any configuration."))
 
+            if any(build.in_progress() for build in data["builds"]):
+                r.append(render_builds_in_progress(app_name=self.context.get("app_name")))
+
             r.extend([
-                a.content("Recent Configuration Builds", headers=[
+                a.content("Configuration Builds ({0} total)".format(data["builds_count"]), headers=[
                     {"id": "actions", "title": "Actions"},
                     {"id": "build_id", "title": "Build ID"},
                     {"id": "comment", "title": "Comment"},
@@ -331,6 +365,8 @@ class ApplicationController(a.AdminController):
                             if data["default_build"] == build.build_id else
                             a.button("app", "Use This", "primary", _method="update_default_configuration",
                                      build_id=build.build_id, app_name=self.context.get("app_name"))
+                            if build.ready() else
+                            render_build_status(build)
                         ],
                         "build_id": build.build_id,
                         "date": str(build.date),
@@ -340,14 +376,15 @@ class ApplicationController(a.AdminController):
                         ],
                         "download": [
                             a.link(build.url, "", icon="download")
-                        ]
+                        ] + [
+                            a.link(url, "", icon="clone") for url in build.mirrors.values()
+                        ] if build.ready() else []
                     }
                     for build in data["builds"]
                 ], style="default")
             ])
 
-            if data["build_pages"] > 1:
-                r.append(a.pages(data["build_pages"], "build_page"))
+            r.extend(render_builds_pages(data, "app", app_name=self.context.get("app_name")))
         else:
             r.append(a.notice(
                 "Please select deployment method",
@@ -373,11 +410,10 @@ class ApplicationController(a.AdminController):
 class ApplicationSettingsController(a.AdminController):
     async def get(self, app_name):
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
 
         try:
-            app = await environment_client.get_app_info(app_name)
+            app = await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
@@ -394,27 +430,54 @@ class ApplicationSettingsController(a.AdminController):
 
         deployment_methods = {t: t.title() for t in DeploymentMethods.types()}
 
-        if not deployment_method:
-            deployment_methods[""] = "< SELECT >"
+        try:
+            targets = await self.application.targets.list_targets(self.gamespace, app_name)
+        except DeploymentTargetError as e:
+            raise a.ActionError(e.message)
 
         result = {
             "app_name": app.title,
-            "deployment_methods": deployment_methods,
+            "deployment_methods": dict(deployment_methods),
             "deployment_method": deployment_method,
-            "deployment_data": deployment_data
+            "deployment_data": deployment_data,
+            "targets": targets,
+            "target_methods": deployment_methods
         }
 
+        if not deployment_method:
+            result["deployment_methods"][""] = "< SELECT >"
+
         return result
 
+    async def add_target(self, target_name, deployment_method):
+
+        app_name = self.context.get("app_name")
+
+        try:
+            await self.application.admin_loader.get_app_info(app_name)
+        except AppNotFound:
+            raise a.ActionError("App was not found.")
+
+        if not DeploymentMethods.valid(deployment_method):
+            raise a.ActionError("Not a valid deployment method")
+
+        try:
+            target_id = await self.application.targets.add_target(
+                self.gamespace, app_name, target_name, deployment_method)
+        except DeploymentTargetError as e:
+            raise a.ActionError(e.message)
+
+        raise a.Redirect("deployment_target", message="Mirror target has been added",
+                         app_name=app_name, target_id=target_id)
+
     async def update_deployment_method(self, deployment_method):
 
         app_name = self.context.get("app_name")
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
 
         try:
-            await environment_client.get_app_info(app_name)
+            await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
@@ -442,11 +505,10 @@ class ApplicationSettingsController(a.AdminController):
 
         app_name = self.context.get("app_name")
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
 
         try:
-            await environment_client.get_app_info(app_name)
+            await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
@@ -508,6 +570,18 @@ class ApplicationSettingsController(a.AdminController):
             }, methods={
                 "update_deployment_method": a.method("Switch deployment method", "primary")
             }, data=data),
+            a.links("Mirror targets (every build is deployed onto each of them too)", [
+                a.link("deployment_target", "{0} ({1})".format(target.target_name, target.deployment_method),
+                       icon="clone", app_name=self.context.get("app_name"), target_id=target.target_id)
+                for target in data["targets"]
+            ]),
+            a.form("Add a mirror target", fields={
+                "target_name": a.field("Target name", "text", "primary", "non-empty", order=1),
+                "deployment_method": a.field(
+                    "Deployment method", "select", "primary", "non-empty", values=data["target_methods"], order=2)
+            }, methods={
+                "add_target": a.method("Add", "primary")
+            }, data={}),
             a.links("Navigate", [
                 a.link("app", "Back", app_name=self.context.get("app_name")),
             ])
@@ -519,72 +593,157 @@ class ApplicationSettingsController(a.AdminController):
         return ["config_admin"]
 
 
+class DeploymentTargetController(a.AdminController):
+    @validate(app_name="str_name", target_id="int")
+    async def get(self, app_name, target_id):
+
+        try:
+            app = await self.application.admin_loader.get_app_info(app_name)
+        except AppNotFound:
+            raise a.ActionError("App was not found.")
+
+        try:
+            target = await self.application.targets.get_target(self.gamespace, app_name, target_id)
+        except NoSuchDeploymentTargetError:
+            raise a.ActionError("No such mirror target")
+        except DeploymentTargetError as e:
+            raise a.ActionError(e.message)
+
+        result = {
+            "app_name": app.title,
+            "target_name": target.target_name,
+            "deployment_method": target.deployment_method,
+            "deployment_data": target.deployment_data
+        }
+
+        return result
+
+    async def update_deployment(self, **kwargs):
+
+        app_name = self.context.get("app_name")
+        target_id = self.context.get("target_id")
+
+        targets = self.application.targets
+
+        try:
+            target = await targets.get_target(self.gamespace, app_name, target_id)
+        except NoSuchDeploymentTargetError:
+            raise a.ActionError("No such mirror target")
+        except DeploymentTargetError as e:
+            raise a.ActionError(e.message)
+
+        m = DeploymentMethods.get(target.deployment_method)()
+
+        m.load(target.deployment_data)
+        await m.update(**kwargs)
+
+        try:
+            await targets.update_target(self.gamespace, app_name, target_id, m.dump())
+        except DeploymentTargetError as e:
+            raise a.ActionError(e.message)
+
+        raise a.Redirect("deployment_target", message="Mirror target settings have been updated",
+                         app_name=app_name, target_id=target_id)
+
+    async def delete_target(self):
+
+        app_name = self.context.get("app_name")
+        target_id = self.context.get("target_id")
+
+        try:
+            await self.application.targets.delete_target(self.gamespace, app_name, target_id)
+        except DeploymentTargetError as e:
+            raise a.ActionError(e.message)
+
+        raise a.Redirect("app_settings", message="Mirror target has been deleted", app_name=app_name)
+
+    def render(self, data):
+
+        r = [
+            a.breadcrumbs([
+                a.link("index", "Applications"),
+                a.link("app", data["app_name"], app_name=self.context.get("app_name")),
+                a.link("app_settings", "Application Settings", app_name=self.context.get("app_name"))
+            ], "Mirror target '{0}'".format(data["target_name"]))
+        ]
+
+        deployment_method = data["deployment_method"]
+        m = DeploymentMethods.get(deployment_method)
+
+        if m is not None and m.has_admin():
+            r.append(a.form(
+                "{0} Deployment settings".format(deployment_method.title()), fields=m.render(a), methods={
+                    "update_deployment": a.method("Update", "primary")
+                }, data=data["deployment_data"], icon="rocket"))
+
+        r.extend([
+            a.form("Delete this mirror target", fields={}, methods={
+                "delete_target": a.method("Delete", "danger", danger="Builds deployed from now on would not "
+                                                                     "be mirrored to this target.")
+            }, data={}),
+            a.links("Navigate", [
+                a.link("app_settings", "Back", app_name=self.context.get("app_name")),
+            ])
+        ])
+
+        return r
+
+    def access_scopes(self):
+        return ["config_admin"]
+
+
 class ApplicationVersionController(a.AdminController):
     BUILDS_PER_PAGE = 10
 
-    @validate(app_name="str_name", app_version="str", build_page="int")
-    async def get(self, app_name, app_version, build_page=1):
+    @validate(app_name="str_name", app_version="str", before="int", after="int")
+    async def get(self, app_name, app_version, before=None, after=None):
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
         builds_data = self.application.builds
+        loader = self.application.admin_loader
+
+        async def get_application():
+            try:
+                return await apps.get_application(self.gamespace, app_name)
+            except NoSuchApplicationError:
+                return None
 
+        async def get_application_version():
+            try:
+                return await apps.get_application_version(self.gamespace, app_name, app_version)
+            except NoSuchApplicationVersionError:
+                return None
+
+        # none of these depend on each other
         try:
-            app = await environment_client.get_app_info(app_name)
+            app, app_settings, version_settings, (builds, has_newer, has_older), builds_count = await gather(
+                loader.get_app_info(app_name),
+                get_application(),
+                get_application_version(),
+                builds_data.list_builds_page(
+                    self.gamespace, app_name,
+                    limit=self.BUILDS_PER_PAGE,
+                    before=before, after=after),
+                builds_data.count_builds(self.gamespace, app_name))
         except AppNotFound:
             raise a.ActionError("App was not found.")
+        except (ConfigApplicationError, ConfigBuildError) as e:
+            raise a.ActionError(e.message)
 
         versions = app.versions
 
         if app_version not in versions:
             raise a.ActionError("No such app version")
 
-        try:
-            await apps.get_application(self.gamespace, app_name)
-        except NoSuchApplicationError:
+        if app_settings is None:
             raise a.Redirect("app_settings", message="Please configure the application first", app_name=app_name)
 
-        try:
-            version_settings = await apps.get_application_version(self.gamespace, app_name, app_version)
-        except NoSuchApplicationVersionError:
-            version_settings = None
-            version_build = None
-        except ConfigApplicationError as e:
-            raise a.ActionError(e.message)
-        else:
-            version_build = version_settings.build
-
-        try:
-            build_items, builds = await builds_data.list_builds_pages(
-                self.gamespace, app_name,
-                limit=ApplicationController.BUILDS_PER_PAGE,
-                offset=(ApplicationController.BUILDS_PER_PAGE * (build_page - 1)))
-        except ConfigBuildError as e:
-            raise a.ActionError(e.message)
+        version_build = version_settings.build if version_settings else None
 
-        build_pages = int(math.ceil(float(build_items) / float(ApplicationController.BUILDS_PER_PAGE)))
+        author_names = await loader.get_author_names(self.gamespace, set(build.author for build in builds))
 
-        author_ids = set()
         for build in builds:
-            build.author_name = str(build.author)
-            author_ids.add(build.author)
-
-        internal = Internal()
-
-        try:
-            profiles = await internal.send_request(
-                "profile", "mass_profiles",
-                accounts=author_ids,
-                gamespace=self.gamespace,
-                action="get_public",
-                profile_fields=["name"])
-        except InternalError:
-            pass  # well
-        else:
-            for build in builds:
-                profile = profiles.get(str(build.author))
-                if profile:
-                    build.author_name = profile.get("name")
+            build.author_name = author_names[build.author]
 
         result = {
             "app_name": app_name,
@@ -594,7 +753,9 @@ class ApplicationVersionController(a.AdminController):
             "builds": builds,
             "app_settings": version_settings,
             "build": version_build,
-            "build_pages": build_pages,
+            "builds_count": builds_count,
+            "newer_builds": builds[0].build_id if has_newer and builds else None,
+            "older_builds": builds[-1].build_id if has_older and builds else None,
             "build_title": "Build {0}".format(version_build) if version_build else "Unset",
         }
 
@@ -605,14 +766,23 @@ class ApplicationVersionController(a.AdminController):
         app_version = self.context.get("app_version")
         build_id = self.context.get("build_id")
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
 
         try:
-            await environment_client.get_app_info(app_name)
+            await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
+        try:
+            build = await self.application.builds.get_build(self.gamespace, build_id)
+        except NoSuchBuildError:
+            raise a.ActionError("No such build")
+        except ConfigBuildError as e:
+            raise a.ActionError(e.message)
+
+        if not build.ready():
+            raise a.ActionError("Build {0} is not deployed yet".format(build_id))
+
         try:
             await apps.update_application_version(self.gamespace, app_name, app_version, build_id)
         except ConfigApplicationError as e:
@@ -626,11 +796,10 @@ class ApplicationVersionController(a.AdminController):
         app_name = self.context.get("app_name")
         app_version = self.context.get("app_version")
 
-        environment_client = EnvironmentClient(self.application.cache)
         apps = self.application.apps
 
         try:
-            await environment_client.get_app_info(app_name)
+            await self.application.admin_loader.get_app_info(app_name)
         except AppNotFound:
             raise a.ActionError("App was not found.")
 
@@ -667,8 +836,12 @@ class ApplicationVersionController(a.AdminController):
                 "Therefore, if the default configuration is not set, users would not "
                 "be able to download any configuration.".format(self.context.get("app_version"))))
 
+        if any(build.in_progress() for build in data["builds"]):
+            r.append(render_builds_in_progress(
+                "app_version", app_name=self.context.get("app_name"), app_version=self.context.get("app_version")))
+
         r.extend([
-            a.content("Recent Configuration Builds", headers=[
+            a.content("Configuration Builds ({0} total)".format(data["builds_count"]), headers=[
                 {"id": "actions", "title": "Actions"},
                 {"id": "build_id", "title": "Build ID"},
                 {"id": "comment", "title": "Comment"},
@@ -683,6 +856,8 @@ class ApplicationVersionController(a.AdminController):
                         a.button("app_version", "Use This", "primary", _method="update_configuration",
                                  build_id=build.build_id, app_name=self.context.get("app_name"),
                                  app_version=self.context.get("app_version"))
+                        if build.ready() else
+                        render_build_status(build)
                     ],
                     "build_id": build.build_id,
                     "date": str(build.date),
@@ -692,14 +867,16 @@ class ApplicationVersionController(a.AdminController):
                     ],
                     "download": [
                         a.link(build.url, "", icon="download")
-                    ]
+                    ] + [
+                        a.link(url, "", icon="clone") for url in build.mirrors.values()
+                    ] if build.ready() else []
                 }
                 for build in data["builds"]
             ], style="default")
         ])
 
-        if data["build_pages"] > 1:
-            r.append(a.pages(data["build_pages"], "build_page"))
+        r.extend(render_builds_pages(
+            data, "app_version", app_name=self.context.get("app_name"), app_version=self.context.get("app_version")))
 
         r.extend([
             a.links("Navigate", [
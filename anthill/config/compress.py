@@ -0,0 +1,117 @@
+
+from tornado.ioloop import IOLoop
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import asyncio
+import logging
+import tempfile
+import shutil
+import gzip
+import os
+
+
+def compress_gzip(path, level):
+    fd, target_path = tempfile.mkstemp()
+
+    with open(path, "rb") as source, os.fdopen(fd, "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=level, mtime=0) as target:
+            shutil.copyfileobj(source, target)
+
+    return target_path
+
+
+def compress_zstd(path, level):
+    fd, target_path = tempfile.mkstemp()
+
+    with open(path, "rb") as source, os.fdopen(fd, "wb") as f:
+        zstandard.ZstdCompressor(level=level).copy_stream(source, f)
+
+    return target_path
+
+
+class BuildCompressor(object):
+    """
+    Makes compressed variants of a build. Compression is done on a pool of worker processes,
+    so it neither blocks the IOLoop, nor competes with it for the GIL.
+
+    A variant is only kept if it's noticeably smaller than the build itself.
+    The zstd encoding requires the optional 'zstandard' package.
+    """
+
+    # encoding -> (compress function, file extension, compression level)
+    ENCODINGS = {
+        "gzip": (compress_gzip, "gz", 9),
+        "zstd": (compress_zstd, "zst", 19)
+    }
+
+    def __init__(self, encodings, workers=2, min_size=1024, max_ratio=0.9):
+        self.encodings = []
+
+        for encoding in encodings:
+            if encoding not in BuildCompressor.ENCODINGS:
+                logging.warning("Unknown build variant encoding '{0}', ignored".format(encoding))
+            elif not BuildCompressor.supported(encoding):
+                logging.warning("Build variant encoding '{0}' is not available (is zstandard installed?), "
+                                "ignored".format(encoding))
+            else:
+                self.encodings.append(encoding)
+
+        self.min_size = min_size
+        self.max_ratio = max_ratio
+        self.executor = ProcessPoolExecutor(max_workers=workers) if self.encodings else None
+
+    @staticmethod
+    def supported(encoding):
+        if encoding not in BuildCompressor.ENCODINGS:
+            return False
+
+        if encoding == "zstd":
+            return zstandard is not None
+
+        return True
+
+    @staticmethod
+    def extension(encoding):
+        return BuildCompressor.ENCODINGS[encoding][1]
+
+    async def __compress__(self, encoding, path, size):
+        compress, extension, level = BuildCompressor.ENCODINGS[encoding]
+
+        compressed_path = await IOLoop.current().run_in_executor(self.executor, compress, path, level)
+        compressed_size = os.path.getsize(compressed_path)
+
+        if compressed_size > size * self.max_ratio:
+            os.remove(compressed_path)
+            return None
+
+        return compressed_path, compressed_size
+
+    async def compress(self, path, size):
+        """
+        Makes every variant of the build at local `path` at the same time
+        :returns: a dict of encoding -> (path to a temporary file with the variant, size of the variant)
+                  The files should be removed by the caller.
+        """
+
+        if not self.encodings or size < self.min_size:
+            return {}
+
+        results = await asyncio.gather(*[
+            self.__compress__(encoding, path, size)
+            for encoding in self.encodings
+        ], return_exceptions=True)
+
+        variants = {}
+
+        for encoding, result in zip(self.encodings, results):
+            if isinstance(result, Exception):
+                logging.warning("Failed to make {0} variant of {1}: {2}".format(encoding, path, str(result)))
+            elif result is not None:
+                variants[encoding] = result
+
+        return variants
@@ -0,0 +1,383 @@
+
+from anthill.common.deployment import DeploymentError
+from anthill.common.model import Model
+
+from . model.builds import BuildsModel, ConfigBuildError, NoSuchBuildError
+from . model.apps import ConfigApplicationError
+from . model.patches import BuildPatchError
+from . patch import BuildPatcherError
+from . upload import BuildUpload
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import logging
+import base64
+import gzip
+import time
+import os
+
+
+class DeploymentJob(object):
+    def __init__(self, gamespace_id, application_name, build_id, deployment, upload,
+                 mirrors=None, switch_default=False):
+        self.gamespace_id = gamespace_id
+        self.application_name = application_name
+        self.build_id = build_id
+        self.deployment = deployment
+        # target_id -> deployment method of a mirror target
+        self.mirrors = mirrors or {}
+        self.upload = upload
+        self.switch_default = switch_default
+        self.attempts = 0
+
+
+class DeploymentQueue(Model):
+    """
+    Deploys uploaded builds in background, with no more than `workers` deployments at the same time.
+
+    A build is pushed onto the deployment target of the application and every mirror target at the same time,
+    with no more than `parallelism` pushes of the same build in flight, so the whole deployment takes about
+    as long as the slowest target does.
+
+    A failed push is retried up to `max_attempts` times, with a delay doubled after each attempt.
+    The progress is tracked with the status of the build (see BuildsModel.update_build_status), so the admin
+    page could show it.
+
+    If `patcher` is given, patches from up to `patch_sources` builds being served at the moment are made
+    and deployed next to the build, before it's marked as ready. Same goes for compressed variants of the build,
+    if `compressor` is given.
+
+    Builds no bigger than `inline_max_size` bytes are also stored in the database as is, so the content
+    could be sent along with the resolution, saving the client a download.
+
+    Builds are uploaded into `uploads_location` (see `receive`). While a build is being uploaded, waiting
+    in the queue, or being deployed, the process keeps touching both the build and the upload. Builds and uploads
+    nobody has touched for `stale_timeout` seconds are left by a process that is gone, so such builds are
+    marked as failed, and such uploads are removed, by any process.
+    """
+
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    def __init__(self, builds, apps, workers=4, max_attempts=5, retry_delay=5, parallelism=4,
+                 patches=None, patcher=None, patch_sources=4, compressor=None, inline_max_size=0,
+                 uploads_location=None, stale_timeout=300):
+        self.builds = builds
+        self.apps = apps
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.parallelism = parallelism
+        self.patches = patches
+        self.patcher = patcher
+        self.patch_sources = patch_sources
+        self.compressor = compressor
+        self.inline_max_size = inline_max_size
+        self.uploads_location = uploads_location
+        self.stale_timeout = stale_timeout
+
+        self.jobs = asyncio.Queue()
+        self.tasks = []
+
+        # build_id -> BuildUpload of every build this process takes care of, from the upload till the deployment
+        self.uploads = {}
+        self.heartbeat_callback = PeriodicCallback(self.__heartbeat__, stale_timeout * 1000 / 3)
+
+    async def started(self, application):
+        await super(DeploymentQueue, self).started(application)
+
+        if self.uploads_location:
+            os.makedirs(self.uploads_location, exist_ok=True)
+
+        # builds interrupted by a restart are dealt with right away
+        await self.__heartbeat__()
+        self.heartbeat_callback.start()
+
+        self.tasks = [asyncio.ensure_future(self.__work__()) for _ in range(self.workers)]
+
+    async def stopped(self):
+        self.heartbeat_callback.stop()
+
+        for task in self.tasks:
+            task.cancel()
+
+        self.tasks = []
+        await super(DeploymentQueue, self).stopped()
+
+    def receive(self, build_id, max_size):
+        """
+        Starts an upload of a just created build
+        :returns: a BuildUpload, to be either put into the queue with a DeploymentJob, or aborted
+        """
+        upload = BuildUpload(max_size=max_size, directory=self.uploads_location)
+        self.uploads[build_id] = upload
+        return upload
+
+    async def abort(self, gamespace_id, build_id):
+        """
+        Removes both the upload of the build, and the build itself
+        """
+        upload = self.uploads.pop(build_id, None)
+
+        if upload is not None:
+            await upload.release()
+
+        try:
+            await self.builds.delete_build(gamespace_id, build_id)
+        except ConfigBuildError as e:
+            logging.error("Failed to delete aborted build {0}: {1}".format(build_id, e.message))
+
+    def put(self, job):
+        self.uploads[job.build_id] = job.upload
+        self.jobs.put_nowait(job)
+
+    async def __heartbeat__(self):
+        for upload in self.uploads.values():
+            upload.touch()
+
+        try:
+            await self.builds.touch_builds(list(self.uploads.keys()))
+            failed = await self.builds.fail_stale_builds(self.stale_timeout, "Deployment has been interrupted")
+        except ConfigBuildError as e:
+            logging.error("Failed to check builds in progress: {0}".format(e.message))
+        else:
+            if failed:
+                logging.warning("Marked {0} interrupted builds as failed".format(failed))
+
+        if self.uploads_location:
+            held = set(upload.path for upload in self.uploads.values())
+
+            await IOLoop.current().run_in_executor(
+                DeploymentQueue.executor, self.__remove_orphans__, held, time.time() - self.stale_timeout)
+
+    def __remove_orphans__(self, held, before):
+        for name in os.listdir(self.uploads_location):
+            path = os.path.join(self.uploads_location, name)
+
+            if path in held:
+                continue
+
+            try:
+                if os.stat(path).st_mtime < before:
+                    os.remove(path)
+                    logging.warning("Removed an orphaned upload '{0}'".format(name))
+            except OSError:
+                pass
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    async def __work__(self):
+        while True:
+            job = await self.jobs.get()
+
+            # noinspection PyBroadException
+            try:
+                await self.__deploy__(job)
+            except Exception as e:
+                logging.exception("Failed to deploy build {0}".format(job.build_id))
+                await self.__failed__(job, str(e), job.attempts)
+            finally:
+                await job.upload.release()
+                self.uploads.pop(job.build_id, None)
+                self.jobs.task_done()
+
+    async def __deploy__(self, job):
+        builds = self.builds
+        upload = job.upload
+
+        # exactly the same configuration might have been deployed already, no need to deploy it again,
+        # unless it's missing on some of the mirror targets
+        try:
+            existing_build = await builds.find_build_by_hash(job.gamespace_id, job.application_name, upload.sha256)
+        except NoSuchBuildError:
+            existing_build = None
+
+        if existing_build and all(target_id in existing_build.mirrors for target_id in job.mirrors):
+            url = existing_build.url
+            mirrors = {target_id: existing_build.mirrors[target_id] for target_id in job.mirrors}
+            variants = existing_build.variants
+        else:
+            deployed = await self.__push_all__(job)
+
+            if deployed is None:
+                return
+
+            url, mirrors = deployed
+
+            if self.compressor is not None:
+                variants = await self.__make_variants__(job)
+            else:
+                variants = None
+
+        if self.patcher is not None:
+            # even if the contents have been deployed already, patches lead to a build of its own
+            await self.__make_patches__(job)
+
+        if self.inline_max_size and upload.size <= self.inline_max_size:
+            content, content_encoding = await IOLoop.current().run_in_executor(
+                DeploymentQueue.executor, DeploymentQueue.__inline__, upload.path)
+        else:
+            content, content_encoding = None, None
+
+        await builds.update_build_url(
+            job.gamespace_id, job.build_id, job.application_name, url,
+            build_hash=upload.sha256, build_size=upload.size, build_mirrors=mirrors, build_variants=variants,
+            build_content=content, build_content_encoding=content_encoding)
+
+        if job.switch_default:
+            try:
+                await self.apps.update_default_build(job.gamespace_id, job.application_name, job.build_id)
+            except ConfigApplicationError as e:
+                logging.error("Build {0} has been deployed, but failed to update default build: {1}".format(
+                    job.build_id, e.message))
+
+    @staticmethod
+    def __inline__(path):
+        """
+        :returns: a tuple of (base64 encoded content, content encoding), the content is gzipped if that helps
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        compressed = gzip.compress(data, mtime=0)
+
+        if len(compressed) < len(data):
+            return base64.b64encode(compressed).decode("ascii"), "gzip"
+
+        return base64.b64encode(data).decode("ascii"), "identity"
+
+    async def __push_all__(self, job):
+        """
+        Pushes the build onto every target concurrently
+        :returns: a tuple of (url, {target_id: url}), or None if any of the targets has failed
+        """
+
+        semaphore = asyncio.Semaphore(self.parallelism)
+        target_ids = list(job.mirrors.keys())
+
+        await self.__attempt__(job, 1)
+
+        results = await asyncio.gather(
+            self.__push__(job, semaphore, job.deployment),
+            *[self.__push__(job, semaphore, job.mirrors[target_id]) for target_id in target_ids],
+            return_exceptions=True)
+
+        errors = []
+
+        for target_id, result in zip([None] + target_ids, results):
+            if isinstance(result, DeploymentError):
+                errors.append(result.message if target_id is None else
+                              "mirror {0}: {1}".format(target_id, result.message))
+            elif isinstance(result, BaseException):
+                raise result
+
+        if errors:
+            await self.__failed__(job, "; ".join(errors), job.attempts)
+            return None
+
+        return results[0], dict(zip(target_ids, results[1:]))
+
+    async def __make_variants__(self, job):
+        # same as patches, the build is fine without compressed variants
+        compressed = await self.compressor.compress(job.upload.path, job.upload.size)
+        variants = {}
+
+        for encoding, (variant_path, variant_size) in compressed.items():
+            try:
+                variant_url = await job.deployment.deploy(
+                    job.gamespace_id, variant_path, job.application_name,
+                    "{0}_{1}.{2}".format(job.gamespace_id, job.build_id, self.compressor.extension(encoding)))
+            except DeploymentError as e:
+                logging.warning("Failed to deploy {0} variant of build {1}: {2}".format(
+                    encoding, job.build_id, e.message))
+                continue
+            finally:
+                os.remove(variant_path)
+
+            variants[encoding] = {
+                "url": variant_url,
+                "size": variant_size
+            }
+
+        return variants
+
+    async def __make_patches__(self, job):
+        # patches are nice to have, so failing to make one never fails the build itself
+        try:
+            sources = await self.patches.list_patch_sources(
+                job.gamespace_id, job.application_name, job.build_id, limit=self.patch_sources)
+        except BuildPatchError as e:
+            logging.warning("Failed to list patch sources for build {0}: {1}".format(job.build_id, e.message))
+            return
+
+        for source in sources:
+            source_build_id = source["build_id"]
+
+            try:
+                made = await self.patcher.make(
+                    source["build_url"], source["build_size"], job.upload.path, job.upload.size)
+            except BuildPatcherError as e:
+                logging.warning("Failed to make a patch from build {0} to build {1}: {2}".format(
+                    source_build_id, job.build_id, e.message))
+                continue
+
+            if made is None:
+                continue
+
+            patch_path, patch_size = made
+
+            try:
+                patch_url = await job.deployment.deploy(
+                    job.gamespace_id, patch_path, job.application_name,
+                    "{0}_{1}_from_{2}.patch".format(job.gamespace_id, job.build_id, source_build_id))
+            except DeploymentError as e:
+                logging.warning("Failed to deploy a patch from build {0} to build {1}: {2}".format(
+                    source_build_id, job.build_id, e.message))
+                continue
+            finally:
+                os.remove(patch_path)
+
+            try:
+                await self.patches.add_patch(
+                    job.gamespace_id, job.application_name, job.build_id, source_build_id, patch_url, patch_size)
+            except BuildPatchError as e:
+                logging.warning("Failed to save a patch from build {0} to build {1}: {2}".format(
+                    source_build_id, job.build_id, e.message))
+
+    async def __attempt__(self, job, attempt):
+        # pushes onto different targets retry independently, the build shows the furthest one
+        if attempt <= job.attempts:
+            return
+
+        job.attempts = attempt
+
+        await self.builds.update_build_status(
+            job.gamespace_id, job.build_id, BuildsModel.STATUS_DEPLOYING, build_attempts=attempt)
+
+    async def __push__(self, job, semaphore, deployment):
+        for attempt in range(1, self.max_attempts + 1):
+            await self.__attempt__(job, attempt)
+
+            try:
+                async with semaphore:
+                    return await deployment.deploy(
+                        job.gamespace_id, job.upload.path, job.application_name,
+                        str(job.gamespace_id) + "_" + str(job.build_id))
+            except DeploymentError as e:
+                logging.warning("Failed to deploy build {0} (attempt {1}): {2}".format(
+                    job.build_id, attempt, e.message))
+
+                if attempt == self.max_attempts:
+                    raise
+
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    async def __failed__(self, job, error, attempts):
+        try:
+            await self.builds.update_build_status(
+                job.gamespace_id, job.build_id, BuildsModel.STATUS_FAILED,
+                build_attempts=attempts, build_error=(error or "")[:255])
+        except ConfigBuildError as e:
+            logging.error("Failed to mark build {0} as failed: {1}".format(job.build_id, e.message))
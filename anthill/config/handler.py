@@ -1,29 +1,337 @@
 
-from anthill.common import access, handler
+from anthill.common import access, handler, admin, to_int, clamp
+from anthill.common.options import options
 
-from tornado.web import HTTPError
+from tornado.web import HTTPError, StaticFileHandler, RequestHandler
+from tornado.iostream import StreamClosedError
+from tornado.ioloop import IOLoop
 
 from anthill.common.access import scoped
-from anthill.common.validate import validate
+from anthill.common.validate import validate, validate_value, ValidationError
 from anthill.common.internal import InternalError
 
 from . model.apps import NoSuchConfigurationError, ConfigApplicationError
+from . model.patches import BuildPatchError
+from . payload import PayloadCacheError
+from . profiler import ProfilerError
+
+import ipaddress
+import asyncio
+import ujson
+import time
+import os
 
 
 class ConfigGetHandler(handler.AuthenticatedHandler):
+    def __init__(self, application, request, **kwargs):
+        super(ConfigGetHandler, self).__init__(application, request, **kwargs)
+        self.build = None
+        self.gamespace_name = ""
+        self.app_name = ""
+
+    def on_finish(self):
+        # recorded here, as the final status (including errors) is only known by now
+        self.application.metrics.request(
+            "config", self.get_status(), self.gamespace_name, self.app_name, self.request.request_time())
+
+    def compute_etag(self):
+        # the response is defined entirely by the build, so there's no need to hash the body
+        # tornado takes care of If-None-Match and responds with 304 if the build has not changed
+        if self.build is None:
+            return None
+
+        return '"{0}"'.format(self.build.build_id)
+
     async def get(self, app_name, app_version):
 
         gamespace_name = self.get_argument("gamespace")
+        # a build the client already has, if any
+        client_build_id = to_int(self.get_argument("build", None))
+
+        self.gamespace_name = gamespace_name
+        self.app_name = app_name
+        metrics = self.application.metrics
 
         try:
-            build = await self.application.apps.get_version_configuration(
+            self.build = await self.application.apps.get_version_configuration(
                 app_name,
                 app_version,
                 gamespace_name=gamespace_name)
         except NoSuchConfigurationError:
             raise HTTPError(404, "Config was not found")
+
+        patch = None
+
+        if options.build_patches and client_build_id and str(client_build_id) != self.build.build_id:
+            started = time.perf_counter()
+
+            try:
+                patch = await self.application.patches.get_patch(self.build.build_id, client_build_id)
+            except BuildPatchError:
+                pass  # the full build would do
+
+            metrics.stage("patch", gamespace_name, app_name, started)
+
+        if patch:
+            patch["from"] = str(client_build_id)
+
+        max_age = options.config_cache_max_age
+
+        if max_age > 0:
+            self.set_header("Cache-Control", "public, max-age={0}".format(max_age))
         else:
-            self.dumps(build.dump())
+            self.set_header("Cache-Control", "no-cache")
+
+        started = time.perf_counter()
+        self.dumps(self.build.dump(patch=patch))
+        metrics.stage("serialize", gamespace_name, app_name, started)
+
+
+class ConfigWatchHandler(handler.AuthenticatedHandler):
+    def __init__(self, application, request, **kwargs):
+        super(ConfigWatchHandler, self).__init__(application, request, **kwargs)
+        self.watch = None
+
+    def on_connection_close(self):
+        if self.watch:
+            self.watch.cancel()
+
+    async def get(self, app_name, app_version):
+
+        gamespace_name = self.get_argument("gamespace")
+        build_id = self.get_argument("build", None)
+        timeout = clamp(to_int(self.get_argument("timeout", None), options.watch_max_timeout),
+                        1, options.watch_max_timeout)
+
+        self.watch = asyncio.ensure_future(self.application.apps.watch_version_configuration(
+            app_name,
+            app_version,
+            timeout,
+            build_id=build_id,
+            gamespace_name=gamespace_name))
+
+        try:
+            build = await self.watch
+        except asyncio.CancelledError:
+            # the client has gone away
+            return
+        except NoSuchConfigurationError:
+            raise HTTPError(404, "Config was not found")
+        except ConfigApplicationError as e:
+            raise HTTPError(e.code, e.message)
+        finally:
+            self.watch = None
+
+        self.set_header("Cache-Control", "no-store")
+
+        if build is None:
+            # nothing has changed within the timeout (not a 304, as the request is not a conditional one)
+            self.set_status(204)
+            return
+
+        self.dumps(build.dump())
+
+
+class ConfigStreamHandler(handler.AuthenticatedHandler):
+    """
+    Server-Sent Events stream of configuration changes within the gamespace.
+    Each event only tells which application (and which version, if not every version) has been changed,
+    so the subscriber could resolve the configuration again. The 'resync' event means that some events
+    have been lost and everything should be resolved again.
+    """
+
+    def __init__(self, application, request, **kwargs):
+        super(ConfigStreamHandler, self).__init__(application, request, **kwargs)
+        self.stream = None
+
+    def on_connection_close(self):
+        if self.stream:
+            self.application.apps.close_stream(self.stream)
+            self.stream = None
+
+    async def get(self):
+
+        gamespace_name = self.get_argument("gamespace")
+        application_names = self.get_argument("applications", None)
+
+        try:
+            self.stream = await self.application.apps.open_stream(
+                gamespace_name=gamespace_name,
+                application_names=application_names.split(",") if application_names else None)
+        except ValidationError as e:
+            raise HTTPError(400, e.message)
+        except ConfigApplicationError as e:
+            raise HTTPError(e.code, e.message)
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-store")
+
+        stream = self.stream
+
+        try:
+            self.write(": connected\n\n")
+            await self.flush()
+
+            while self.stream is stream:
+                try:
+                    event = await stream.next(options.stream_ping_interval)
+                except asyncio.TimeoutError:
+                    # keeps the connection (and proxies in between) alive
+                    self.write(": ping\n\n")
+                else:
+                    if event is stream.RESYNC:
+                        self.write("event: resync\ndata: {}\n\n")
+                    else:
+                        self.write("event: changed\ndata: {0}\n\n".format(ujson.dumps(event)))
+
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self.on_connection_close()
+
+
+class AdminUploadHandler(admin.AdminUploadHandler):
+    """
+    Same as the regular one, but lets the action know if the client has gone away in the middle of the upload
+    (see DeployBuildController.receive_aborted), so what has been uploaded so far is cleaned up right away
+    """
+
+    def on_connection_close(self):
+        super(AdminUploadHandler, self).on_connection_close()
+
+        receive_aborted = getattr(self.action, "receive_aborted", None)
+
+        if receive_aborted is not None and not self._finished:
+            IOLoop.current().spawn_callback(receive_aborted)
+
+
+class DownloadHandler(StaticFileHandler):
+    """
+    Serves deployed files (builds, their variants and patches) right from data_runtime_location,
+    so the service could act as an origin for a CDN, or even as the CDN itself.
+
+    Range requests and If-None-Match / If-Modified-Since are handled by StaticFileHandler.
+    """
+
+    def compute_etag(self):
+        # a deployed file is named after the build (ids are never reused) and is never modified, so the name
+        # identifies the contents as strictly as a hash would, and the same on every node serving it
+        try:
+            size = os.path.getsize(self.absolute_path)
+        except OSError:
+            return None
+
+        return '"{0}-{1:x}"'.format(self.path.replace('"', ""), size)
+
+    def get_cache_time(self, path, modified, mime_type):
+        return options.download_cache_max_age
+
+    def set_extra_headers(self, path):
+        max_age = options.download_cache_max_age
+
+        if max_age > 0:
+            self.set_header("Cache-Control", "public, max-age={0}, immutable".format(max_age))
+
+
+class PayloadHandler(DownloadHandler):
+    """
+    Serves the payload of a configuration itself, through the pull-through cache (see PayloadCache),
+    so the node could act as a regional cache in front of a remote store builds are deployed onto.
+    """
+
+    def __init__(self, application, request, **kwargs):
+        super(PayloadHandler, self).__init__(application, request, **kwargs)
+        self.build = None
+
+    async def get(self, app_name, app_version, include_body=True):
+
+        gamespace_name = self.get_argument("gamespace")
+
+        try:
+            self.build = await self.application.apps.get_version_configuration(
+                app_name,
+                app_version,
+                gamespace_name=gamespace_name)
+        except NoSuchConfigurationError:
+            raise HTTPError(404, "Config was not found")
+
+        try:
+            name = await self.application.payloads.get(self.build)
+        except PayloadCacheError as e:
+            raise HTTPError(e.code, e.message)
+
+        await super(PayloadHandler, self).get(name, include_body=include_body)
+
+    def head(self, app_name, app_version):
+        return self.get(app_name, app_version, include_body=False)
+
+    def get_cache_time(self, path, modified, mime_type):
+        # unlike a deployed file, the payload of a version changes once another build is set for it
+        return options.config_cache_max_age
+
+    def set_extra_headers(self, path):
+        self.set_header("X-Config-Build", self.build.build_id)
+
+        if options.config_cache_max_age <= 0:
+            self.set_header("Cache-Control", "no-cache")
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Exposes ResolutionMetrics in Prometheus text format, to allowed (internal) networks only
+    """
+
+    # noinspection PyMethodOverriding
+    def initialize(self, allowed_networks):
+        self.allowed_networks = [
+            ipaddress.ip_network(network.strip())
+            for network in allowed_networks.split(",")
+            if network.strip()
+        ]
+
+    def get(self):
+        try:
+            remote_ip = ipaddress.ip_address(self.request.remote_ip)
+        except ValueError:
+            raise HTTPError(403)
+
+        if not any(remote_ip in network for network in self.allowed_networks):
+            raise HTTPError(403)
+
+        self.set_header("Content-Type", self.application.metrics.CONTENT_TYPE)
+        self.set_header("Cache-Control", "no-cache")
+        self.write(self.application.metrics.render())
+
+
+def dump_configurations(builds):
+    result = {}
+
+    for (application_name, application_version), build in builds.items():
+        result.setdefault(application_name, {})[application_version] = build.dump() if build else {
+            "code": 404,
+            "error": "Config was not found"
+        }
+
+    return result
+
+
+class ConfigsGetHandler(handler.AuthenticatedHandler):
+    async def get(self):
+
+        gamespace_name = self.get_argument("gamespace")
+
+        try:
+            applications = validate_value(self.get_argument("applications"), "load_json_dict")
+            builds = await self.application.apps.get_versions_configuration(
+                applications,
+                gamespace_name=gamespace_name)
+        except ValidationError as e:
+            raise HTTPError(400, e.message)
+        except ConfigApplicationError as e:
+            raise HTTPError(e.code, e.message)
+
+        self.dumps(dump_configurations(builds))
 
 
 class InternalHandler(object):
@@ -33,12 +341,63 @@ class InternalHandler(object):
     @validate(app_name="str", app_version="str", gamespace="int")
     async def get_configuration(self, app_name, app_version, gamespace):
 
+        metrics = self.application.metrics
+        started = time.perf_counter()
+        status = 500
+
         try:
             build = await self.application.apps.get_version_configuration(
                 app_name,
                 app_version,
                 gamespace_id=gamespace)
         except NoSuchConfigurationError:
+            status = 404
             raise InternalError(404, "Config was not found")
+        except ConfigApplicationError as e:
+            status = e.code
+            raise
         else:
-            return build.dump()
+            status = 200
+            dumped = time.perf_counter()
+            result = build.dump()
+            metrics.stage("serialize", gamespace, app_name, dumped)
+            return result
+        finally:
+            metrics.request("internal", status, gamespace, app_name, time.perf_counter() - started)
+
+    @validate(applications="json_dict", gamespace="int")
+    async def get_configurations(self, applications, gamespace):
+
+        try:
+            builds = await self.application.apps.get_versions_configuration(
+                applications,
+                gamespace_id=gamespace)
+        except ValidationError as e:
+            raise InternalError(400, e.message)
+        except ConfigApplicationError as e:
+            raise InternalError(e.code, e.message)
+
+        return dump_configurations(builds)
+
+    @validate(duration="float", interval="float")
+    async def profile(self, duration, interval=0.005):
+        """
+        Samples stacks of the process for `duration` seconds (every `interval` seconds, no more often than
+        ProcessProfiler.MIN_INTERVAL), and returns them in collapsed stack format
+        """
+        try:
+            return await self.application.profiler.sample(duration, interval=interval or 0.005)
+        except ProfilerError as e:
+            raise InternalError(e.code, e.message)
+
+    @validate(duration="float", limit="int", frames="int")
+    async def trace_allocations(self, duration, limit=20, frames=10):
+        """
+        Traces memory allocations for `duration` seconds, and returns the top `limit` of them
+        (up to ProcessProfiler.MAX_LIMIT, `frames` deep, up to ProcessProfiler.MAX_FRAMES)
+        """
+        try:
+            return await self.application.profiler.trace_allocations(
+                duration, limit=limit or 20, frames=frames or 10)
+        except ProfilerError as e:
+            raise InternalError(e.code, e.message)
@@ -0,0 +1,93 @@
+
+from anthill.common.environment import EnvironmentClient
+from anthill.common.internal import Internal, InternalError
+
+from . model.cache import LocalCache, SingleFlight
+
+import asyncio
+
+
+async def gather(*aws):
+    """
+    Same as asyncio.gather, except that every awaitable is awaited till the end, even if some
+    of them have failed, and the first exception is raised after that
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return results
+
+
+class AdminDataLoader(object):
+    """
+    Loads data every admin page needs from other services, memoizing it for `ttl` seconds,
+    since the same data is requested over and over again while the user clicks through the pages
+    (and by every action the user makes on them).
+    """
+
+    def __init__(self, cache, ttl=10, max_size=1000):
+        self.environment_client = EnvironmentClient(cache)
+        self.internal = Internal()
+        self.flights = SingleFlight()
+
+        self.apps = LocalCache(max_size=max_size, ttl=ttl)
+        self.profiles = LocalCache(max_size=max_size * 10, ttl=ttl)
+
+    async def __get_app_info__(self, app_name):
+        app = await self.environment_client.get_app_info(app_name)
+        self.apps.set(app_name, app)
+        return app
+
+    async def get_app_info(self, app_name):
+        """
+        :raises AppNotFound: if there is no such app (that is not memoized)
+        """
+        app = self.apps.get(app_name)
+
+        if app is not None:
+            return app
+
+        return await self.flights.run(app_name, self.__get_app_info__, app_name)
+
+    async def get_author_names(self, gamespace_id, accounts):
+        """
+        :returns: a dict of account -> name, an account is named by its id if the name is unknown
+        """
+        names = {}
+        missing = set()
+
+        for account in accounts:
+            name = self.profiles.get((gamespace_id, account))
+
+            if name is None:
+                missing.add(account)
+                names[account] = str(account)
+            else:
+                names[account] = name
+
+        if not missing:
+            return names
+
+        try:
+            profiles = await self.internal.send_request(
+                "profile", "mass_profiles",
+                accounts=list(missing),
+                gamespace=gamespace_id,
+                action="get_public",
+                profile_fields=["name"])
+        except InternalError:
+            return names  # well
+
+        for account in missing:
+            profile = profiles.get(str(account))
+            name = profile.get("name") if profile else None
+
+            if name:
+                names[account] = name
+
+            self.profiles.set((gamespace_id, account), names[account])
+
+        return names
@@ -0,0 +1,219 @@
+
+from bisect import bisect_left
+
+import time
+
+
+# in seconds, a resolution is expected to take from well under a millisecond (in memory) to a few of them
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# a value of request-defined labels of every series beyond `max_series`
+OVERFLOW = "other"
+
+# labels with values coming from requests
+UNBOUNDED_LABELS = ("gamespace", "application")
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metric(object):
+    """
+    A family of series of the same metric, one series per set of label values.
+
+    Some label values are not known in advance (see UNBOUNDED_LABELS), so once there are `max_series`
+    series already, these labels of every new series are recorded as OVERFLOW instead.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, description, labels, max_series=1000):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.max_series = max_series
+        self.series = {}
+        self.unbounded = [i for i, label in enumerate(labels) if label in UNBOUNDED_LABELS]
+
+    def __series__(self, values):
+        series = self.series.get(values)
+
+        if series is not None:
+            return series
+
+        if len(self.series) >= self.max_series:
+            values = tuple(
+                OVERFLOW if i in self.unbounded else value
+                for i, value in enumerate(values))
+            series = self.series.get(values)
+
+            if series is not None:
+                return series
+
+        series = self.new_series()
+        self.series[values] = series
+        return series
+
+    def new_series(self):
+        raise NotImplementedError()
+
+    def render_series(self, labels, series):
+        raise NotImplementedError()
+
+    def render_labels(self, values, extra=""):
+        labels = ",".join(
+            "{0}=\"{1}\"".format(label, escape(value))
+            for label, value in zip(self.labels, values))
+
+        if extra:
+            labels = labels + "," + extra if labels else extra
+
+        return "{" + labels + "}" if labels else ""
+
+    def render(self):
+        lines = [
+            "# HELP {0} {1}".format(self.name, self.description),
+            "# TYPE {0} {1}".format(self.name, self.TYPE)
+        ]
+
+        for values, series in list(self.series.items()):
+            lines.extend(self.render_series(values, series))
+
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def new_series(self):
+        return [0]
+
+    def inc(self, *values):
+        self.__series__(values)[0] += 1
+
+    def render_series(self, values, series):
+        return ["{0}{1} {2}".format(self.name, self.render_labels(values), series[0])]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, description, labels, buckets=LATENCY_BUCKETS, max_series=1000):
+        super(Histogram, self).__init__(name, description, labels, max_series=max_series)
+        self.buckets = buckets
+
+    def new_series(self):
+        # non-cumulative counts of every bucket (and +Inf), then the sum of observed values
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *values):
+        series = self.__series__(values)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render_series(self, values, series):
+        lines = []
+        count = 0
+
+        for bucket, bucket_count in zip(self.buckets + ("+Inf",), series):
+            count += bucket_count
+            lines.append("{0}_bucket{1} {2}".format(
+                self.name, self.render_labels(values, "le=\"{0}\"".format(bucket)), count))
+
+        lines.append("{0}_sum{1} {2}".format(self.name, self.render_labels(values), series[-1]))
+        lines.append("{0}_count{1} {2}".format(self.name, self.render_labels(values), count))
+        return lines
+
+
+class Stats(object):
+    """
+    Counters an object keeps on its own (like LocalCache.stats), read upon rendering only.
+    """
+
+    def __init__(self, prefix, description, stats, counters=()):
+        self.prefix = prefix
+        self.description = description
+        self.stats = stats
+        self.counters = counters
+
+    def render(self):
+        lines = []
+
+        for key, value in self.stats().items():
+            if key in self.counters:
+                name, kind = "{0}_{1}_total".format(self.prefix, key), "counter"
+            else:
+                name, kind = "{0}_{1}".format(self.prefix, key), "gauge"
+
+            lines.extend([
+                "# HELP {0} {1} ({2}).".format(name, self.description, key),
+                "# TYPE {0} {1}".format(name, kind),
+                "{0} {1}".format(name, value)
+            ])
+
+        return lines
+
+
+class ResolutionMetrics(object):
+    """
+    Latencies of every stage of the resolution path, and its outcomes, labeled by gamespace (as requested,
+    either a name or an id) and application. Rendered in Prometheus text format (see MetricsHandler).
+
+    Recording is a couple of dict lookups, and nothing at all if not `enabled`. Stats kept by the caches
+    themselves (see add_stats) are exposed as well.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, enabled=True, max_series=1000):
+        self.enabled = enabled
+
+        self.stages = Histogram(
+            "config_resolution_stage_seconds",
+            "Time spent on a stage of the resolution: gamespace (name lookup), snapshot, cache, "
+            "database, patch, serialize.",
+            ("stage", "gamespace", "application"), max_series=max_series)
+
+        self.cache = Counter(
+            "config_resolution_cache_total",
+            "Lookups of resolved configurations by the cache consulted (snapshot, resolved) and the result "
+            "(hit, miss, not_found).",
+            ("cache", "result", "gamespace", "application"), max_series=max_series)
+
+        self.requests = Histogram(
+            "config_request_seconds",
+            "Time spent on a configuration request, by the handler and the response status.",
+            ("handler", "status", "gamespace", "application"), max_series=max_series)
+
+        self.stats = []
+
+    def add_stats(self, prefix, description, stats, counters=()):
+        """
+        Exposes what `stats()` returns (a dict of name -> number) as metrics named `prefix`_name,
+        names listed in `counters` are exposed as counters, the rest as gauges
+        """
+        self.stats.append(Stats(prefix, description, stats, counters=counters))
+
+    def stage(self, stage, gamespace, application, started):
+        """
+        Records a stage that has been started at `started` (see time.perf_counter) and has just finished
+        """
+        if self.enabled:
+            self.stages.observe(time.perf_counter() - started, stage, gamespace, application)
+
+    def cache_lookup(self, cache, result, gamespace, application):
+        if self.enabled:
+            self.cache.inc(cache, result, gamespace, application)
+
+    def request(self, handler, status, gamespace, application, duration):
+        if self.enabled:
+            self.requests.observe(duration, handler, status, gamespace, application)
+
+    def render(self):
+        lines = []
+
+        for metric in [self.stages, self.cache, self.requests] + self.stats:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
@@ -1,13 +1,22 @@
 
+from tornado.ioloop import IOLoop
+
 from anthill.common.database import DatabaseError
 from anthill.common.model import Model
-from anthill.common.validate import validate
+from anthill.common.validate import validate, validate_value
 from anthill.common.internal import Internal
-from anthill.common.login import LoginClient, LoginClientError
+from anthill.common.login import LoginClientError
 
 from . builds import ConfigBuildAdapter
+from . cache import ResolvedConfigurationCache, SingleFlight
+from . snapshot import record_change
+from . resolution import DEFAULT_VERSION, populate_effective_builds, resolve_effective_build, resolve_effective_builds
+from . resolution import set_effective_build, delete_effective_build
+from . watch import ConfigurationWatchers, ConfigurationStreams
+from .. metrics import ResolutionMetrics
 
 import ujson
+import time
 
 
 class ConfigApplicationError(Exception):
@@ -49,66 +58,256 @@ class ConfigApplicationAdapter(object):
 
 
 class BuildApplicationsModel(Model):
-    def __init__(self, db, cache):
+    MAX_BATCH_SIZE = 64
+
+    def __init__(self, db, cache, resolved, gamespaces, snapshot=None, stream_buffer_size=64, metrics=None):
         self.db = db
         self.cache = cache
+        self.resolved = resolved
+        self.gamespaces = gamespaces
+        self.snapshot = snapshot
+        self.metrics = metrics or ResolutionMetrics(enabled=False)
+        self.resolve_flights = SingleFlight()
+        self.watchers = ConfigurationWatchers()
+        self.streams = ConfigurationStreams(buffer_size=stream_buffer_size)
         self.internal = Internal()
 
+        self.resolved.add_listener(self.__invalidated__)
+
     def get_setup_db(self):
         return self.db
 
-    def get_setup_tables(self):
-        return ["config_applications", "config_application_versions"]
+    async def started(self, application):
+        await super(BuildApplicationsModel, self).started(application)
+        self.gamespaces.start()
+        self.resolved.start()
 
-    @validate(gamespace_name="str", gamespace_id="int", application_name="str_name", application_version="str")
-    async def get_version_configuration(self, application_name, application_version, gamespace_name=None, gamespace_id=None):
+        if self.snapshot:
+            await self.snapshot.start()
 
-        if gamespace_name:
+    async def stopped(self):
+        self.gamespaces.stop()
+        self.resolved.stop()
+
+        if self.snapshot:
+            self.snapshot.stop()
+
+        await super(BuildApplicationsModel, self).stopped()
+
+    def __invalidated__(self, gamespace_id, application_name, application_version):
+        if self.snapshot:
+            IOLoop.current().spawn_callback(
+                self.__refresh_snapshot__, gamespace_id, application_name, application_version)
+        else:
+            self.__changed__(gamespace_id, application_name, application_version)
 
-            login_client = LoginClient(self.cache)
+    async def __refresh_snapshot__(self, gamespace_id, application_name, application_version):
+        # no need to wait for the next scheduled refresh, the change is already there
+        await self.snapshot.refresh()
+        self.__changed__(gamespace_id, application_name, application_version)
 
+    def __changed__(self, gamespace_id, application_name, application_version):
+        self.watchers.changed(gamespace_id, application_name, application_version)
+        self.streams.changed(gamespace_id, application_name, application_version)
+
+    @validate(gamespace_name="str", gamespace_id="int", application_names="json_list_of_str_name")
+    async def open_stream(self, gamespace_name=None, gamespace_id=None, application_names=None):
+        """
+        Subscribes to configuration changes of the gamespace (optionally, of certain applications only).
+        Please close the stream returned with `close_stream` once done.
+        """
+        gamespace_id = await self.__get_gamespace_id__(gamespace_name, gamespace_id)
+        return self.streams.open(gamespace_id, application_names)
+
+    def close_stream(self, stream):
+        self.streams.close(stream)
+
+    def get_setup_tables(self):
+        return ["config_applications", "config_application_versions", "config_changes", "config_resolved"]
+
+    def get_setup_events(self):
+        return ["config_changes_cleanup"]
+
+    async def setup_table_config_resolved(self):
+        # the table is new to existing setups, so it's filled up with what is already configured
+        await populate_effective_builds(self.db)
+
+    async def __get_gamespace_id__(self, gamespace_name, gamespace_id):
+        if gamespace_name:
             try:
-                gamespace_info = await login_client.find_gamespace(gamespace_name)
+                gamespace_id = await self.gamespaces.get_gamespace_id(gamespace_name)
             except LoginClientError as e:
                 raise ConfigApplicationError(e.code, e.message)
 
-            gamespace_id = gamespace_info.gamespace_id
-
         if not gamespace_id:
             raise ConfigApplicationError(400, "Either 'gamespace_name' or 'gamespace_id' should be defined.")
 
+        return gamespace_id
+
+    @validate(gamespace_name="str", gamespace_id="int", application_name="str_name", application_version="str")
+    async def get_version_configuration(self, application_name, application_version, gamespace_name=None, gamespace_id=None):
+
+        gamespace = gamespace_name or gamespace_id
+        metrics = self.metrics
+
+        started = time.perf_counter()
+        gamespace_id = await self.__get_gamespace_id__(gamespace_name, gamespace_id)
+        metrics.stage("gamespace", gamespace, application_name, started)
+
+        if self.snapshot and self.snapshot.ready:
+            started = time.perf_counter()
+            build = self.snapshot.get(gamespace_id, application_name, application_version)
+            metrics.stage("snapshot", gamespace, application_name, started)
+
+            if build is None:
+                metrics.cache_lookup("snapshot", "not_found", gamespace, application_name)
+                raise NoSuchConfigurationError()
+
+            metrics.cache_lookup("snapshot", "hit", gamespace, application_name)
+            return ConfigBuildAdapter(build)
+
+        started = time.perf_counter()
+        build = await self.resolved.get(gamespace_id, application_name, application_version)
+        metrics.stage("cache", gamespace, application_name, started)
+
+        if build is ResolvedConfigurationCache.NOT_FOUND:
+            metrics.cache_lookup("resolved", "not_found", gamespace, application_name)
+            raise NoSuchConfigurationError()
+
+        if build is None:
+            metrics.cache_lookup("resolved", "miss", gamespace, application_name)
+
+            # concurrent requests for the same configuration share a single lookup, unless the application
+            # has been invalidated since the lookup has started (it could have read what is already changed)
+            started = time.perf_counter()
+            generation = self.resolved.local_generation(gamespace_id, application_name)
+
+            try:
+                build = await self.resolve_flights.run(
+                    (gamespace_id, application_name, application_version, generation),
+                    self.__resolve_and_cache__, gamespace_id, application_name, application_version)
+            finally:
+                metrics.stage("database", gamespace, application_name, started)
+        else:
+            metrics.cache_lookup("resolved", "hit", gamespace, application_name)
+
+        return ConfigBuildAdapter(build)
+
+    async def __resolve_and_cache__(self, gamespace_id, application_name, application_version):
+        generation = await self.resolved.generation(gamespace_id, application_name)
+
         try:
-            # look for per-version configuration first
-            # if failed, fallback to per-app configuration
-            # if even that is failed, we have a 404 here
-            build = await self.db.get(
-                """
-                SELECT * 
-                FROM `config_builds` AS b
-                WHERE b.`gamespace_id`=%s AND b.`application_name`=%s AND b.`build_id` = COALESCE(
-                    (
-                        SELECT `build_id` 
-                        FROM `config_application_versions` AS v
-                        WHERE v.`gamespace_id` = b.`gamespace_id` AND v.`application_name` = b.`application_name`
-                            AND v.`application_version`=%s
-                        LIMIT 1
-                    ),
-                    (
-                        SELECT `default_build`
-                        FROM `config_applications` AS a
-                        WHERE a.`gamespace_id`= b.`gamespace_id` AND a.`application_name` = b.`application_name`
-                        LIMIT 1
-                    )
-                )
-                LIMIT 1;
-                """, gamespace_id, application_name, application_version)
+            build = await self.__resolve_version_configuration__(
+                gamespace_id, application_name, application_version)
+        except NoSuchConfigurationError:
+            self.resolved.set_not_found(gamespace_id, application_name, application_version, generation)
+            raise
+
+        await self.resolved.set(gamespace_id, application_name, application_version, build, generation)
+        return build
+
+    async def __resolve_version_configuration__(self, gamespace_id, application_name, application_version):
+        try:
+            build = await resolve_effective_build(self.db, gamespace_id, application_name, application_version)
         except DatabaseError as e:
             raise ConfigApplicationError(500, e.args[1])
 
         if not build:
             raise NoSuchConfigurationError()
 
-        return ConfigBuildAdapter(build)
+        return build
+
+    @validate(application_name="str_name", application_version="str", timeout="int", build_id="str",
+              gamespace_name="str", gamespace_id="int")
+    async def watch_version_configuration(self, application_name, application_version, timeout, build_id=None,
+                                          gamespace_name=None, gamespace_id=None):
+        """
+        Waits for a configuration of the application version to become different from `build_id`
+        :returns: a new ConfigBuildAdapter, or None if nothing has changed within `timeout` seconds
+        :raises NoSuchConfigurationError: if the configuration is (or became) unset
+        """
+
+        gamespace_id = await self.__get_gamespace_id__(gamespace_name, gamespace_id)
+        deadline = time.monotonic() + timeout
+
+        while True:
+            # the watch is taken before the resolution, so a change in between is not missed
+            with self.watchers.watch(gamespace_id, application_name, application_version) as watch:
+                try:
+                    build = await self.get_version_configuration(
+                        application_name, application_version, gamespace_id=gamespace_id)
+                except NoSuchConfigurationError:
+                    if build_id:
+                        raise
+                else:
+                    if build.build_id != build_id:
+                        return build
+
+                time_left = deadline - time.monotonic()
+
+                if time_left <= 0 or not await watch.wait(time_left):
+                    return None
+
+    @validate(gamespace_name="str", gamespace_id="int", applications="json_dict")
+    async def get_versions_configuration(self, applications, gamespace_name=None, gamespace_id=None):
+        """
+        Resolves configurations of several application versions at once
+        :param applications: a dict of application name -> a list of application versions
+        :returns: a dict of (application_name, application_version) -> ConfigBuildAdapter,
+                  or None if there is no configuration for such application version
+        """
+
+        gamespace_id = await self.__get_gamespace_id__(gamespace_name, gamespace_id)
+
+        keys = []
+
+        for application_name, application_versions in applications.items():
+            validate_value(application_name, "str_name")
+
+            for application_version in validate_value(application_versions, "json_list_of_strings"):
+                keys.append((application_name, application_version))
+
+        if len(keys) > BuildApplicationsModel.MAX_BATCH_SIZE:
+            raise ConfigApplicationError(400, "Too many application versions requested at once")
+
+        if self.snapshot and self.snapshot.ready:
+            builds = {
+                (application_name, application_version): self.snapshot.get(
+                    gamespace_id, application_name, application_version)
+                for application_name, application_version in keys
+            }
+        else:
+            builds = await self.resolved.get_many(gamespace_id, keys)
+            missing = [key for key in keys if key not in builds]
+
+            if missing:
+                generations = await self.resolved.generations(
+                    gamespace_id, set(application_name for application_name, _ in missing))
+
+                resolved = await self.__resolve_versions_configuration__(gamespace_id, missing)
+
+                for application_name, application_version in missing:
+                    if (application_name, application_version) not in resolved:
+                        self.resolved.set_not_found(
+                            gamespace_id, application_name, application_version, generations[application_name])
+                        builds[(application_name, application_version)] = None
+
+                if resolved:
+                    await self.resolved.set_many(gamespace_id, resolved, generations)
+
+                builds.update(resolved)
+
+        return {
+            key: ConfigBuildAdapter(build)
+            if build is not None and build is not ResolvedConfigurationCache.NOT_FOUND else None
+            for key, build in builds.items()
+        }
+
+    async def __resolve_versions_configuration__(self, gamespace_id, keys):
+        try:
+            return await resolve_effective_builds(self.db, gamespace_id, keys)
+        except DatabaseError as e:
+            raise ConfigApplicationError(500, e.args[1])
 
     @validate(gamespace_id="int", application_name="str_name", deployment_method="str_name",
               deployment_data="json_dict")
@@ -128,16 +327,23 @@ class BuildApplicationsModel(Model):
     @validate(gamespace_id="int", application_name="str_name")
     async def delete_application_settings(self, gamespace_id, application_name):
         try:
-            deleted = await self.db.execute(
-                """
-                DELETE 
-                FROM `config_applications`
-                WHERE `gamespace_id`=%s AND `application_name`=%s
-                LIMIT 1;
-                """, gamespace_id, application_name)
+            async with self.db.acquire(auto_commit=False) as db:
+                deleted = await db.execute(
+                    """
+                    DELETE 
+                    FROM `config_applications`
+                    WHERE `gamespace_id`=%s AND `application_name`=%s
+                    LIMIT 1;
+                    """, gamespace_id, application_name)
+
+                await delete_effective_build(db, gamespace_id, application_name, DEFAULT_VERSION)
+                await record_change(db, gamespace_id, application_name)
+                await db.commit()
         except DatabaseError as e:
             raise ConfigApplicationError(500, e.args[1])
 
+        await self.resolved.invalidate_application(gamespace_id, application_name)
+
         return bool(deleted)
 
     @validate(gamespace_id="int", application_name="str_name")
@@ -161,60 +367,90 @@ class BuildApplicationsModel(Model):
     @validate(gamespace_id="int", application_name="str_name", default_build="int")
     async def update_default_build(self, gamespace_id, application_name, default_build):
         try:
-            updated = await self.db.execute(
-                """
-                UPDATE `config_applications`
-                SET `default_build`=%s
-                WHERE `gamespace_id`=%s AND `application_name`=%s
-                LIMIT 1;
-                """, default_build, gamespace_id, application_name)
+            async with self.db.acquire(auto_commit=False) as db:
+                updated = await db.execute(
+                    """
+                    UPDATE `config_applications`
+                    SET `default_build`=%s
+                    WHERE `gamespace_id`=%s AND `application_name`=%s
+                    LIMIT 1;
+                    """, default_build, gamespace_id, application_name)
+
+                if updated:
+                    await set_effective_build(db, gamespace_id, application_name, DEFAULT_VERSION, default_build)
+
+                await record_change(db, gamespace_id, application_name)
+                await db.commit()
         except DatabaseError as e:
             raise ConfigApplicationError(500, e.args[1])
 
+        await self.resolved.invalidate_application(gamespace_id, application_name)
+
         return bool(updated)
 
     @validate(gamespace_id="int", application_name="str_name")
     async def unset_default_build(self, gamespace_id, application_name):
         try:
-            updated = await self.db.execute(
-                """
-                UPDATE `config_applications`
-                SET `default_build`=NULL
-                WHERE `gamespace_id`=%s AND `application_name`=%s
-                LIMIT 1;
-                """, gamespace_id, application_name)
+            async with self.db.acquire(auto_commit=False) as db:
+                updated = await db.execute(
+                    """
+                    UPDATE `config_applications`
+                    SET `default_build`=NULL
+                    WHERE `gamespace_id`=%s AND `application_name`=%s
+                    LIMIT 1;
+                    """, gamespace_id, application_name)
+
+                await delete_effective_build(db, gamespace_id, application_name, DEFAULT_VERSION)
+                await record_change(db, gamespace_id, application_name)
+                await db.commit()
         except DatabaseError as e:
             raise ConfigApplicationError(500, e.args[1])
 
+        await self.resolved.invalidate_application(gamespace_id, application_name)
+
         return bool(updated)
 
     @validate(gamespace_id="int", application_name="str_name", application_version="str", build_id="int")
     async def update_application_version(self, gamespace_id, application_name, application_version, build_id):
         try:
-            await self.db.execute(
-                """
-                INSERT INTO `config_application_versions`
-                (`gamespace_id`, `application_name`, `application_version`, `build_id`) 
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY 
-                UPDATE `build_id`=VALUES(`build_id`);
-                """, gamespace_id, application_name, application_version, build_id)
+            async with self.db.acquire(auto_commit=False) as db:
+                await db.execute(
+                    """
+                    INSERT INTO `config_application_versions`
+                    (`gamespace_id`, `application_name`, `application_version`, `build_id`) 
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY 
+                    UPDATE `build_id`=VALUES(`build_id`);
+                    """, gamespace_id, application_name, application_version, build_id)
+
+                await set_effective_build(db, gamespace_id, application_name, application_version, build_id)
+                await record_change(db, gamespace_id, application_name)
+                await db.commit()
         except DatabaseError as e:
             raise ConfigApplicationError(500, e.args[1])
 
+        await self.resolved.invalidate_version(gamespace_id, application_name, application_version)
+
     @validate(gamespace_id="int", application_name="str_name", application_version="str")
     async def delete_application_version(self, gamespace_id, application_name, application_version):
         try:
-            deleted = await self.db.execute(
-                """
-                DELETE 
-                FROM `config_application_versions`
-                WHERE `gamespace_id`=%s AND `application_name`=%s AND `application_version`=%s
-                LIMIT 1;
-                """, gamespace_id, application_name, application_version)
+            async with self.db.acquire(auto_commit=False) as db:
+                deleted = await db.execute(
+                    """
+                    DELETE 
+                    FROM `config_application_versions`
+                    WHERE `gamespace_id`=%s AND `application_name`=%s AND `application_version`=%s
+                    LIMIT 1;
+                    """, gamespace_id, application_name, application_version)
+
+                await delete_effective_build(db, gamespace_id, application_name, application_version)
+                await record_change(db, gamespace_id, application_name)
+                await db.commit()
         except DatabaseError as e:
             raise ConfigApplicationError(500, e.args[1])
 
+        await self.resolved.invalidate_version(gamespace_id, application_name, application_version)
+
         return bool(deleted)
 
     @validate(gamespace_id="int", application_name="str_name", application_version="str")
@@ -2,6 +2,12 @@
 from anthill.common.database import DatabaseError
 from anthill.common.model import Model
 from anthill.common.validate import validate
+from anthill.common import cached
+
+from . snapshot import record_change
+
+import logging
+import ujson
 
 
 class ConfigBuildError(Exception):
@@ -25,17 +31,76 @@ class ConfigBuildAdapter(object):
         self.date = data.get("build_date")
         self.comment = data.get("build_comment")
         self.author = data.get("build_author")
+        self.hash = data.get("build_hash")
+        self.size = data.get("build_size")
+        self.status = data.get("build_status")
+        self.attempts = data.get("build_attempts")
+        self.error = data.get("build_error")
+        # target_id -> url of the same build deployed onto a mirror target
+        self.mirrors = data.get("build_mirrors") or {}
+        # encoding -> {"url": ..., "size": ...} of compressed variants of the build
+        self.variants = data.get("build_variants") or {}
+        # base64 encoded content of a small enough build (see options.inline_max_size)
+        self.content = data.get("build_content")
+        self.content_encoding = data.get("build_content_encoding")
+
+    def ready(self):
+        return self.status == BuildsModel.STATUS_READY
+
+    def in_progress(self):
+        return self.status in (BuildsModel.STATUS_PENDING, BuildsModel.STATUS_DEPLOYING)
 
-    def dump(self):
-        return {
+    def dump(self, patch=None):
+        result = {
             "url": self.url,
             "id": self.build_id
         }
 
+        if self.variants:
+            result["variants"] = self.variants
+
+        if self.content is not None:
+            result["content"] = self.content
+            result["content_encoding"] = self.content_encoding
+
+        if patch:
+            # the client may download a (much smaller) patch onto the build it has instead
+            result["patch"] = patch
+
+        return result
+
 
 class BuildsModel(Model):
-    def __init__(self, db):
+    STATUS_PENDING = "pending"
+    STATUS_DEPLOYING = "deploying"
+    STATUS_READY = "ready"
+    STATUS_FAILED = "failed"
+
+    # columns `config_builds` has gained since it has been introduced (see config_builds.sql)
+    COLUMNS = [
+        ("build_hash", "char(64) DEFAULT NULL"),
+        ("build_size", "int(11) unsigned NOT NULL DEFAULT '0'"),
+        ("build_status", "enum('pending','deploying','ready','failed') NOT NULL DEFAULT 'pending'"),
+        ("build_attempts", "int(11) unsigned NOT NULL DEFAULT '0'"),
+        ("build_error", "varchar(255) NOT NULL DEFAULT ''"),
+        ("build_mirrors", "json DEFAULT NULL"),
+        ("build_variants", "json DEFAULT NULL"),
+        ("build_content", "mediumtext"),
+        ("build_content_encoding", "varchar(16) DEFAULT NULL"),
+        ("build_heartbeat", "datetime DEFAULT NULL")
+    ]
+
+    INDEXES = [
+        ("gamespace_id", ["gamespace_id", "application_name", "build_id"]),
+        ("build_hash", ["gamespace_id", "application_name", "build_hash"]),
+        ("build_status", ["build_status"])
+    ]
+
+    def __init__(self, db, cache, resolved, count_ttl=60):
         self.db = db
+        self.cache = cache
+        self.resolved = resolved
+        self.count_ttl = count_ttl
 
     def get_setup_db(self):
         return self.db
@@ -43,6 +108,74 @@ class BuildsModel(Model):
     def get_setup_tables(self):
         return ["config_builds"]
 
+    async def started(self, application):
+        await super(BuildsModel, self).started(application)
+        await self.__migrate__()
+
+    async def __migrate__(self):
+        """
+        Brings `config_builds` of an existing setup up to date, as the table is only created if it's missing
+        """
+        try:
+            columns = await self.db.query(
+                """
+                SELECT `COLUMN_NAME`
+                FROM `information_schema`.`COLUMNS`
+                WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`='config_builds';
+                """)
+
+            indexes = await self.db.query(
+                """
+                SHOW INDEX FROM `config_builds`;
+                """)
+        except DatabaseError as e:
+            logging.error("Failed to check 'config_builds' for migration: {0}".format(e.args[1]))
+            return
+
+        existing_columns = set(column["COLUMN_NAME"] for column in columns)
+        existing_indexes = {}
+
+        for index in sorted(indexes, key=lambda i: i["Seq_in_index"]):
+            existing_indexes.setdefault(index["Key_name"], []).append(index["Column_name"])
+
+        alter = [
+            "ADD COLUMN `{0}` {1}".format(column, definition)
+            for column, definition in BuildsModel.COLUMNS
+            if column not in existing_columns
+        ]
+
+        for index, index_columns in BuildsModel.INDEXES:
+            if existing_indexes.get(index) == index_columns:
+                continue
+
+            if index in existing_indexes:
+                alter.append("DROP INDEX `{0}`".format(index))
+
+            alter.append("ADD INDEX `{0}` ({1})".format(
+                index, ", ".join("`{0}`".format(column) for column in index_columns)))
+
+        if not alter:
+            return
+
+        try:
+            await self.db.execute(
+                """
+                ALTER TABLE `config_builds` {0};
+                """.format(", ".join(alter)))
+
+            if "build_status" not in existing_columns:
+                # builds used to be deployed right away, so every build that has an url is deployed,
+                # and the rest have failed to
+                await self.db.execute(
+                    """
+                    UPDATE `config_builds`
+                    SET `build_status`=IF(`build_url` IS NULL, 'failed', 'ready');
+                    """)
+        except DatabaseError as e:
+            logging.error("Failed to migrate 'config_builds': {0}".format(e.args[1]))
+        else:
+            logging.warning("Migrated 'config_builds': {0}".format(", ".join(alter)))
+
     @validate(gamespace_id="int", application_name="str_name", build_comment="str", build_author="int")
     async def create_build(self, gamespace_id, application_name, build_comment, build_author):
         try:
@@ -55,33 +188,49 @@ class BuildsModel(Model):
         except DatabaseError as e:
             raise ConfigBuildError(500, e.args[1])
 
+        await self.__count_changed__(gamespace_id, application_name)
+
         return build_id
 
-    @validate(gamespace_id="int", build_id="int", application_name="str_name", build_url="str")
-    async def update_build_url(self, gamespace_id, build_id, application_name, build_url):
+    @validate(gamespace_id="int", build_id="int", application_name="str_name", build_url="str",
+              build_hash="str", build_size="int", build_mirrors="json_dict", build_variants="json_dict",
+              build_content="str", build_content_encoding="str_name")
+    async def update_build_url(self, gamespace_id, build_id, application_name, build_url,
+                               build_hash=None, build_size=0, build_mirrors=None, build_variants=None,
+                               build_content=None, build_content_encoding=None):
         try:
             updated = await self.db.execute(
                 """
                 UPDATE `config_builds`
-                SET `build_url`=%s
+                SET `build_url`=%s, `build_hash`=%s, `build_size`=%s, `build_mirrors`=%s, `build_variants`=%s,
+                    `build_content`=%s, `build_content_encoding`=%s, `build_status`='ready', `build_error`=''
                 WHERE `gamespace_id`=%s AND `application_name`=%s AND `build_id`=%s
                 LIMIT 1;
-                """, build_url, gamespace_id, application_name, build_id)
+                """, build_url, build_hash, build_size,
+                ujson.dumps(build_mirrors) if build_mirrors else None,
+                ujson.dumps(build_variants) if build_variants else None,
+                build_content, build_content_encoding,
+                gamespace_id, application_name, build_id)
         except DatabaseError as e:
             raise ConfigBuildError(500, e.args[1])
 
         return bool(updated)
 
-    @validate(gamespace_id="int", build_id="int")
-    async def get_build(self, gamespace_id, build_id):
+    @validate(gamespace_id="int", application_name="str_name", build_hash="str")
+    async def find_build_by_hash(self, gamespace_id, application_name, build_hash):
+        """
+        Looks for an already deployed build of the application with exactly the same contents
+        """
         try:
             build = await self.db.get(
                 """
                 SELECT * 
                 FROM `config_builds`
-                WHERE `gamespace_id`=%s AND `build_id`=%s
+                WHERE `gamespace_id`=%s AND `application_name`=%s AND `build_hash`=%s
+                    AND `build_status`='ready'
+                ORDER BY `build_id` DESC
                 LIMIT 1;
-                """, gamespace_id, build_id)
+                """, gamespace_id, application_name, build_hash)
         except DatabaseError as e:
             raise ConfigBuildError(500, e.args[1])
 
@@ -90,12 +239,63 @@ class BuildsModel(Model):
 
         return ConfigBuildAdapter(build)
 
+    @validate(gamespace_id="int", build_id="int", build_status="str", build_attempts="int", build_error="str")
+    async def update_build_status(self, gamespace_id, build_id, build_status, build_attempts=0, build_error=""):
+        try:
+            updated = await self.db.execute(
+                """
+                UPDATE `config_builds`
+                SET `build_status`=%s, `build_attempts`=%s, `build_error`=%s
+                WHERE `gamespace_id`=%s AND `build_id`=%s
+                LIMIT 1;
+                """, build_status, build_attempts, build_error, gamespace_id, build_id)
+        except DatabaseError as e:
+            raise ConfigBuildError(500, e.args[1])
+
+        return bool(updated)
+
+    @validate(build_ids="json_list_of_ints")
+    async def touch_builds(self, build_ids):
+        """
+        Lets everyone know the builds in progress are still taken care of (see fail_stale_builds)
+        """
+        if not build_ids:
+            return
+
+        try:
+            await self.db.execute(
+                """
+                UPDATE `config_builds`
+                SET `build_heartbeat`=NOW()
+                WHERE `build_id` IN ({0});
+                """.format(", ".join(["%s"] * len(build_ids))), *build_ids)
+        except DatabaseError as e:
+            raise ConfigBuildError(500, e.args[1])
+
+    @validate(timeout="int", build_error="str")
+    async def fail_stale_builds(self, timeout, build_error):
+        """
+        Marks builds that are in progress, but nobody has taken care of (see touch_builds) for `timeout` seconds,
+        as failed, as the process that has been uploading or deploying them is gone
+        :returns: a number of builds marked as failed
+        """
+        try:
+            return await self.db.execute(
+                """
+                UPDATE `config_builds`
+                SET `build_status`='failed', `build_error`=%s
+                WHERE `build_status` IN ('pending', 'deploying')
+                    AND COALESCE(`build_heartbeat`, `build_date`) < NOW() - INTERVAL %s SECOND;
+                """, build_error, timeout)
+        except DatabaseError as e:
+            raise ConfigBuildError(500, e.args[1])
+
     @validate(gamespace_id="int", build_id="int")
-    async def delete_build(self, gamespace_id, build_id):
+    async def get_build(self, gamespace_id, build_id):
         try:
-            deleted = await self.db.execute(
+            build = await self.db.get(
                 """
-                DELETE 
+                SELECT * 
                 FROM `config_builds`
                 WHERE `gamespace_id`=%s AND `build_id`=%s
                 LIMIT 1;
@@ -103,6 +303,43 @@ class BuildsModel(Model):
         except DatabaseError as e:
             raise ConfigBuildError(500, e.args[1])
 
+        if not build:
+            raise NoSuchBuildError()
+
+        return ConfigBuildAdapter(build)
+
+    @validate(gamespace_id="int", build_id="int")
+    async def delete_build(self, gamespace_id, build_id):
+        try:
+            async with self.db.acquire() as db:
+                build = await db.get(
+                    """
+                    SELECT `application_name`
+                    FROM `config_builds`
+                    WHERE `gamespace_id`=%s AND `build_id`=%s
+                    LIMIT 1;
+                    """, gamespace_id, build_id)
+
+                if not build:
+                    return False
+
+                deleted = await db.execute(
+                    """
+                    DELETE 
+                    FROM `config_builds`
+                    WHERE `gamespace_id`=%s AND `build_id`=%s
+                    LIMIT 1;
+                    """, gamespace_id, build_id)
+
+                await record_change(db, gamespace_id, build["application_name"])
+        except DatabaseError as e:
+            raise ConfigBuildError(500, e.args[1])
+
+        # the build may be referenced as a default or per-version one, and these references
+        # are cascaded by the database, so every resolved version of the application is affected
+        await self.resolved.invalidate_application(gamespace_id, build["application_name"])
+        await self.__count_changed__(gamespace_id, build["application_name"])
+
         return bool(deleted)
 
     @validate(gamespace_id="int", application_name="str_name", limit="int", offset="int")
@@ -112,7 +349,7 @@ class BuildsModel(Model):
                 """
                 SELECT * 
                 FROM `config_builds`
-                WHERE `gamespace_id`=%s AND `application_name`=%s AND `build_url` IS NOT NULL
+                WHERE `gamespace_id`=%s AND `application_name`=%s AND `build_status`='ready'
                 ORDER BY `build_id` DESC
                 LIMIT %s, %s;
                 """, gamespace_id, application_name, offset, limit)
@@ -121,26 +358,82 @@ class BuildsModel(Model):
 
         return list(map(ConfigBuildAdapter, builds))
 
-    @validate(gamespace_id="int", application_name="str_name", limit="int", offset="int")
-    async def list_builds_pages(self, gamespace_id, application_name, limit=20, offset=0):
+    @validate(gamespace_id="int", application_name="str_name", limit="int", before="int", after="int")
+    async def list_builds_page(self, gamespace_id, application_name, limit=20, before=None, after=None):
+        """
+        Lists a page of builds, newest first, starting right after a known build instead of skipping a number
+        of them, so a page costs the same no matter how deep it is.
+
+        :param before: to list builds older than this one (the next page)
+        :param after: to list builds newer than this one (the previous page)
+        :returns: a tuple of (builds, has_newer, has_older)
+        """
+
+        if after is not None:
+            condition, order = "AND `build_id`>%s", "ASC"
+            args = [after]
+        elif before is not None:
+            condition, order = "AND `build_id`<%s", "DESC"
+            args = [before]
+        else:
+            condition, order = "", "DESC"
+            args = []
+
         try:
-            async with self.db.acquire() as db:
-                builds = await db.query(
-                    """
-                    SELECT SQL_CALC_FOUND_ROWS * 
+            # build ids are taken from the (`gamespace_id`, `application_name`, `build_id`) index alone,
+            # and only the rows of the page itself are read from the table
+            builds = await self.db.query(
+                """
+                SELECT b.*
+                FROM (
+                    SELECT `build_id`
                     FROM `config_builds`
-                    WHERE `gamespace_id`=%s AND `application_name`=%s AND `build_url` IS NOT NULL
-                    ORDER BY `build_id` DESC
-                    LIMIT %s, %s;
-                    """, gamespace_id, application_name, offset, limit)
+                    WHERE `gamespace_id`=%s AND `application_name`=%s {0}
+                    ORDER BY `build_id` {1}
+                    LIMIT %s
+                ) AS p
+                INNER JOIN `config_builds` AS b ON b.`build_id`=p.`build_id`
+                ORDER BY b.`build_id` {1};
+                """.format(condition, order), gamespace_id, application_name, *args, limit + 1)
+        except DatabaseError as e:
+            raise ConfigBuildError(500, e.args[1])
+
+        # one more build is requested just to know if there's another page
+        more = len(builds) > limit
+        builds = list(builds[:limit])
+
+        if after is not None:
+            builds.reverse()
+            has_newer, has_older = more, True
+        else:
+            has_newer, has_older = before is not None, more
+
+        return list(map(ConfigBuildAdapter, builds)), has_newer, has_older
 
-                count_result = await db.get(
+    async def __count_changed__(self, gamespace_id, application_name):
+        async with self.cache.acquire() as db:
+            await db.delete("config_builds_count:{0}:{1}".format(gamespace_id, application_name))
+
+    @validate(gamespace_id="int", application_name="str_name")
+    async def count_builds(self, gamespace_id, application_name):
+        """
+        Returns the number of builds of the application, cached for a while, so it's approximate
+        """
+
+        @cached(kv=self.cache,
+                h=lambda: "config_builds_count:{0}:{1}".format(gamespace_id, application_name),
+                ttl=self.count_ttl)
+        async def get():
+            try:
+                count = await self.db.get(
                     """
-                        SELECT FOUND_ROWS() AS count;
-                    """)
-                count_result = count_result["count"]
+                    SELECT COUNT(*) AS `count`
+                    FROM `config_builds`
+                    WHERE `gamespace_id`=%s AND `application_name`=%s;
+                    """, gamespace_id, application_name)
+            except DatabaseError as e:
+                raise ConfigBuildError(500, e.args[1])
 
-        except DatabaseError as e:
-            raise ConfigBuildError(500, e.args[1])
+            return count["count"]
 
-        return count_result, map(ConfigBuildAdapter, builds)
+        return int(await get())
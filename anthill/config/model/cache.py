@@ -0,0 +1,409 @@
+
+from collections import OrderedDict
+
+import asyncio
+import logging
+import ujson
+import time
+
+
+class LocalCache(object):
+    """
+    A bounded in-process LRU cache with per-item expiration.
+    Least recently used items are evicted once the cache grows beyond `max_size`.
+    """
+
+    def __init__(self, max_size=10000, ttl=10):
+        self.items = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        item = self.items.get(key)
+
+        if item is None:
+            self.misses += 1
+            return default
+
+        value, expires = item
+
+        if expires < time.monotonic():
+            del self.items[key]
+            self.misses += 1
+            return default
+
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.max_size <= 0:
+            return
+
+        self.items[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self.items.move_to_end(key)
+
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self.items.pop(key, None)
+
+    def delete_if(self, predicate):
+        for key in [key for key in self.items if predicate(key)]:
+            del self.items[key]
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls that share the same key: while a call is in flight, every other caller
+    with the same key awaits for its result (or exception) instead of doing the same work again.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __landed__(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+        if not flight.cancelled():
+            # mark the exception as retrieved in case every caller has gone away
+            flight.exception()
+
+    async def run(self, key, method, *args, **kwargs):
+        flight = self.flights.get(key)
+
+        if flight is None:
+            flight = asyncio.ensure_future(method(*args, **kwargs))
+            flight.add_done_callback(lambda f: self.__landed__(key, f))
+            self.flights[key] = flight
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        # a caller that gets cancelled should not cancel the call for the others
+        return await asyncio.shield(flight)
+
+    def stats(self):
+        return {
+            "in_flight": len(self.flights),
+            "calls": self.calls,
+            "coalesced": self.coalesced
+        }
+
+
+class ResolvedConfigurationCache(object):
+    """
+    Keeps resolved (gamespace, application, version) -> build records in the key/value storage,
+    so the resolution of a configuration does not have to hit the database every time.
+
+    Every application has its own hash, with application versions as fields. That way a change that affects
+    every version of the application (like a default build switch) drops the whole hash at once.
+
+    On top of that, each process keeps recently resolved records in a local LRU cache, along with
+    the versions known to have no configuration at all (see NOT_FOUND).
+
+    Every invalidation is published on a pub/sub channel of the key/value storage, so every process
+    (see `start`) evicts the affected records from its local cache as well, and notifies its listeners.
+
+    A resolution may read the database right before a change is committed, and try to cache what it has read
+    right after the change has been invalidated. To prevent that, every application has a generation,
+    bumped by every invalidation (both in the storage and in every process), and a resolved record is only
+    cached if the generation taken before reading the database (see `generations`) is still the same.
+    """
+
+    NOT_FOUND = object()
+    CHANNEL = "config_resolved_invalidated"
+
+    # KEYS: the generation, the hash; ARGV: expected generation, ttl, then field, value pairs
+    SET_SCRIPT = """
+        if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+            return 0
+        end
+        for i = 3, #ARGV, 2 do
+            redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        end
+        redis.call('EXPIRE', KEYS[2], ARGV[2])
+        return 1
+    """
+
+    def __init__(self, cache, local, ttl=3600, not_found_ttl=5):
+        self.cache = cache
+        self.local = local
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.listeners = []
+        self.listen_task = None
+        # (gamespace_id, application_name) -> generation of the application known by this process
+        self.local_generations = {}
+
+    def add_listener(self, listener):
+        """
+        Adds a callback listener(gamespace_id, application_name, application_version) to be called upon
+        every invalidation, made on any process. If application_version is None, every version
+        of the application is affected.
+        """
+        self.listeners.append(listener)
+
+    def start(self):
+        self.listen_task = asyncio.ensure_future(self.__listen__())
+
+    def stop(self):
+        if self.listen_task:
+            self.listen_task.cancel()
+            self.listen_task = None
+
+    async def __listen__(self):
+        while True:
+            # noinspection PyBroadException
+            try:
+                async with self.cache.acquire() as db:
+                    channel, = await db.subscribe(ResolvedConfigurationCache.CHANNEL)
+
+                    # invalidations could have been missed while the channel was not subscribed
+                    self.local.clear()
+
+                    while await channel.wait_message():
+                        message = await channel.get_json()
+                        self.__invalidated__(
+                            message.get("gamespace"),
+                            message.get("application"),
+                            message.get("version"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Invalidation channel has been lost")
+
+            await asyncio.sleep(1)
+
+    def __invalidated__(self, gamespace_id, application_name, application_version):
+        self.__evict__(gamespace_id, application_name, application_version)
+
+        for listener in self.listeners:
+            # noinspection PyBroadException
+            try:
+                listener(gamespace_id, application_name, application_version)
+            except Exception:
+                logging.exception("Failed to notify invalidation listener")
+
+    def __evict__(self, gamespace_id, application_name, application_version=None):
+        key = (gamespace_id, application_name)
+        self.local_generations[key] = self.local_generations.get(key, 0) + 1
+
+        if application_version is None:
+            self.local.delete_if(lambda key: key[0] == gamespace_id and key[1] == application_name)
+        else:
+            self.local.delete((gamespace_id, application_name, application_version))
+
+    @staticmethod
+    async def __publish__(db, gamespace_id, application_name, application_version=None):
+        await db.publish_json(ResolvedConfigurationCache.CHANNEL, {
+            "gamespace": gamespace_id,
+            "application": application_name,
+            "version": application_version
+        })
+
+    @staticmethod
+    def __key__(gamespace_id, application_name):
+        return "config_resolved:{0}:{1}".format(gamespace_id, application_name)
+
+    @staticmethod
+    def __generation_key__(gamespace_id, application_name):
+        # has no expiration, otherwise the same generation could be seen twice
+        return "config_resolved_generation:{0}:{1}".format(gamespace_id, application_name)
+
+    def local_generation(self, gamespace_id, application_name):
+        return self.local_generations.get((gamespace_id, application_name), 0)
+
+    async def generations(self, gamespace_id, application_names):
+        """
+        Takes generations of the applications, to be passed to `set`, `set_many` or `set_not_found`.
+        Should be taken before the database is read.
+        :returns: a dict of application_name -> generation
+        """
+        application_names = list(application_names)
+
+        async with self.cache.acquire() as db:
+            shared = await db.mget(*[
+                ResolvedConfigurationCache.__generation_key__(gamespace_id, application_name)
+                for application_name in application_names
+            ])
+
+        return {
+            application_name: (self.local_generation(gamespace_id, application_name), int(generation or 0))
+            for application_name, generation in zip(application_names, shared)
+        }
+
+    async def generation(self, gamespace_id, application_name):
+        """
+        Same as `generations`, but for a single application
+        """
+        return (await self.generations(gamespace_id, [application_name]))[application_name]
+
+    def __current__(self, gamespace_id, application_name, generation):
+        return self.local_generation(gamespace_id, application_name) == generation[0]
+
+    async def get(self, gamespace_id, application_name, application_version):
+        """
+        Returns a cached build record, NOT_FOUND if the version is known to have no configuration,
+        or None if nothing is cached.
+        """
+
+        local_key = (gamespace_id, application_name, application_version)
+        build = self.local.get(local_key)
+
+        if build is not None:
+            return build
+
+        async with self.cache.acquire() as db:
+            build = await db.hget(
+                ResolvedConfigurationCache.__key__(gamespace_id, application_name),
+                application_version)
+
+        if build is None:
+            return None
+
+        build = ujson.loads(build)
+        self.local.set(local_key, build)
+        return build
+
+    async def get_many(self, gamespace_id, keys):
+        """
+        Same as `get`, but for a list of (application_name, application_version) pairs at once.
+        Returns a dict of pairs that are cached, pairs that are not are simply missing.
+        """
+
+        result = {}
+        missing = []
+
+        for application_name, application_version in keys:
+            build = self.local.get((gamespace_id, application_name, application_version))
+
+            if build is None:
+                missing.append((application_name, application_version))
+            else:
+                result[(application_name, application_version)] = build
+
+        if not missing:
+            return result
+
+        async with self.cache.acquire() as db:
+            pipeline = db.pipeline()
+
+            for application_name, application_version in missing:
+                pipeline.hget(
+                    ResolvedConfigurationCache.__key__(gamespace_id, application_name),
+                    application_version)
+
+            builds = await pipeline.execute()
+
+        for (application_name, application_version), build in zip(missing, builds):
+            if build is None:
+                continue
+
+            build = ujson.loads(build)
+            self.local.set((gamespace_id, application_name, application_version), build)
+            result[(application_name, application_version)] = build
+
+        return result
+
+    def set_not_found(self, gamespace_id, application_name, application_version, generation):
+        if not self.__current__(gamespace_id, application_name, generation):
+            return
+
+        self.local.set(
+            (gamespace_id, application_name, application_version),
+            ResolvedConfigurationCache.NOT_FOUND, ttl=self.not_found_ttl)
+
+    async def set(self, gamespace_id, application_name, application_version, build, generation):
+        """
+        Caches a resolved build record, unless the application has been invalidated since `generation`
+        was taken (see `generation`)
+        """
+        await self.set_many(gamespace_id, {(application_name, application_version): build}, {
+            application_name: generation
+        })
+
+    async def set_many(self, gamespace_id, builds, generations):
+        """
+        Same as `set`, but for a dict of (application_name, application_version) -> build at once,
+        with a dict of application_name -> generation
+        """
+
+        applications = {}
+
+        for (application_name, application_version), build in builds.items():
+            if self.__current__(gamespace_id, application_name, generations[application_name]):
+                applications.setdefault(application_name, {})[application_version] = build
+
+        if not applications:
+            return
+
+        async with self.cache.acquire() as db:
+            pipeline = db.pipeline()
+
+            for application_name, versions in applications.items():
+                args = [str(generations[application_name][1]), self.ttl]
+
+                for application_version, build in versions.items():
+                    args.extend((application_version, ujson.dumps(build)))
+
+                pipeline.eval(
+                    ResolvedConfigurationCache.SET_SCRIPT,
+                    keys=[
+                        ResolvedConfigurationCache.__generation_key__(gamespace_id, application_name),
+                        ResolvedConfigurationCache.__key__(gamespace_id, application_name)
+                    ],
+                    args=args)
+
+            stored = await pipeline.execute()
+
+        for (application_name, versions), application_stored in zip(applications.items(), stored):
+            # the application could have been invalidated while the records were being stored
+            if not application_stored or \
+                    not self.__current__(gamespace_id, application_name, generations[application_name]):
+                continue
+
+            for application_version, build in versions.items():
+                self.local.set((gamespace_id, application_name, application_version), build)
+
+    async def invalidate_application(self, gamespace_id, application_name):
+        self.__evict__(gamespace_id, application_name)
+
+        async with self.cache.acquire() as db:
+            transaction = db.multi_exec()
+            transaction.incr(ResolvedConfigurationCache.__generation_key__(gamespace_id, application_name))
+            transaction.delete(ResolvedConfigurationCache.__key__(gamespace_id, application_name))
+            await transaction.execute()
+
+            await ResolvedConfigurationCache.__publish__(db, gamespace_id, application_name)
+
+    async def invalidate_version(self, gamespace_id, application_name, application_version):
+        self.__evict__(gamespace_id, application_name, application_version)
+
+        async with self.cache.acquire() as db:
+            transaction = db.multi_exec()
+            transaction.incr(ResolvedConfigurationCache.__generation_key__(gamespace_id, application_name))
+            transaction.hdel(ResolvedConfigurationCache.__key__(gamespace_id, application_name), application_version)
+            await transaction.execute()
+
+            await ResolvedConfigurationCache.__publish__(db, gamespace_id, application_name, application_version)
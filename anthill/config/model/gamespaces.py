@@ -0,0 +1,66 @@
+
+from tornado.ioloop import PeriodicCallback
+
+from anthill.common.login import LoginClient, LoginClientError
+
+import logging
+import time
+
+
+class GamespaceNamesCache(object):
+    """
+    Remembers gamespace name -> gamespace id mapping in memory of the process, so a public request
+    does not need to consult the login service (or even the regular cache) to find the gamespace.
+
+    Known names are refreshed in the background every `refresh_interval` seconds. If the refresh keeps
+    failing, a name is forgotten after `ttl` seconds and will be looked up again upon next request.
+    """
+
+    def __init__(self, cache, ttl=300, refresh_interval=60, login_client=None):
+        self.login_client = login_client or LoginClient(cache)
+        self.ttl = ttl
+        self.gamespaces = {}
+        self.refresh_callback = PeriodicCallback(self.__refresh__, refresh_interval * 1000)
+
+    def start(self):
+        self.refresh_callback.start()
+
+    def stop(self):
+        self.refresh_callback.stop()
+
+    async def __find__(self, gamespace_name):
+        gamespace_info = await self.login_client.find_gamespace(gamespace_name)
+
+        if gamespace_info is None:
+            raise LoginClientError(404, "No such gamespace")
+
+        gamespace_id = gamespace_info.gamespace_id
+        self.gamespaces[gamespace_name] = (gamespace_id, time.monotonic() + self.ttl)
+        return gamespace_id
+
+    async def __refresh__(self):
+        for gamespace_name in list(self.gamespaces.keys()):
+            try:
+                await self.__find__(gamespace_name)
+            except LoginClientError as e:
+                logging.warning("Failed to refresh gamespace '{0}': {1}".format(gamespace_name, e.message))
+
+                gamespace_id, expires = self.gamespaces.get(gamespace_name, (None, 0))
+                if expires < time.monotonic():
+                    self.gamespaces.pop(gamespace_name, None)
+
+    async def get_gamespace_id(self, gamespace_name):
+        """
+        Returns an id of the gamespace by its name
+        :raises LoginClientError: if no such gamespace could be found
+        """
+
+        known = self.gamespaces.get(gamespace_name)
+
+        if known is not None:
+            gamespace_id, expires = known
+
+            if expires >= time.monotonic():
+                return gamespace_id
+
+        return await self.__find__(gamespace_name)
@@ -0,0 +1,117 @@
+
+from anthill.common.database import DatabaseError
+from anthill.common.model import Model
+from anthill.common.validate import validate
+from anthill.common import cached
+
+
+class BuildPatchError(Exception):
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return str(self.code) + ": " + str(self.message)
+
+
+class BuildPatchesModel(Model):
+    """
+    Binary patches that turn one build of an application into another one. A patch is deployed next
+    to the build it leads to, and offered to a client that reports the build it already has.
+    """
+
+    def __init__(self, db, cache, ttl=300):
+        self.db = db
+        self.cache = cache
+        self.ttl = ttl
+
+    def get_setup_db(self):
+        return self.db
+
+    def get_setup_tables(self):
+        return ["config_build_patches"]
+
+    @validate(gamespace_id="int", application_name="str_name", build_id="int", source_build_id="int",
+              patch_url="str", patch_size="int")
+    async def add_patch(self, gamespace_id, application_name, build_id, source_build_id, patch_url, patch_size):
+        try:
+            await self.db.execute(
+                """
+                INSERT INTO `config_build_patches`
+                (`gamespace_id`, `application_name`, `build_id`, `source_build_id`, `patch_url`, `patch_size`)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY
+                UPDATE `patch_url`=VALUES(`patch_url`), `patch_size`=VALUES(`patch_size`);
+                """, gamespace_id, application_name, build_id, source_build_id, patch_url, patch_size)
+        except DatabaseError as e:
+            raise BuildPatchError(500, e.args[1])
+
+        # the patch might have been looked up (and found missing) already
+        async with self.cache.acquire() as db:
+            await db.delete("config_patch:{0}:{1}".format(build_id, source_build_id))
+
+    @validate(build_id="int", source_build_id="int")
+    async def get_patch(self, build_id, source_build_id):
+        """
+        Returns a patch from the build `source_build_id` to the build `build_id` as a dict of url and size,
+        or None if there is no such patch.
+
+        Patches never change once made, and a missing one is dropped from the cache once it's made
+        (see add_patch), so the result (missing patch included) is safe to cache.
+        """
+
+        @cached(kv=self.cache,
+                h=lambda: "config_patch:{0}:{1}".format(build_id, source_build_id),
+                ttl=self.ttl,
+                json=True)
+        async def get():
+            try:
+                patch = await self.db.get(
+                    """
+                    SELECT `patch_url`, `patch_size`
+                    FROM `config_build_patches`
+                    WHERE `build_id`=%s AND `source_build_id`=%s
+                    LIMIT 1;
+                    """, build_id, source_build_id)
+            except DatabaseError as e:
+                raise BuildPatchError(500, e.args[1])
+
+            if not patch:
+                return {}
+
+            return {
+                "url": patch["patch_url"],
+                "size": patch["patch_size"]
+            }
+
+        return (await get()) or None
+
+    @validate(gamespace_id="int", application_name="str_name", build_id="int", limit="int")
+    async def list_patch_sources(self, gamespace_id, application_name, build_id, limit=4):
+        """
+        Returns builds a patch to the build `build_id` is worth making from: the ones clients are
+        being served right now, that is, the default build and builds of configured application versions.
+        """
+        try:
+            sources = await self.db.query(
+                """
+                SELECT `build_id`, `build_url`, `build_size`
+                FROM `config_builds`
+                WHERE `gamespace_id`=%s AND `application_name`=%s AND `build_id`<>%s AND `build_status`='ready'
+                    AND `build_id` IN (
+                        SELECT `default_build`
+                        FROM `config_applications`
+                        WHERE `gamespace_id`=%s AND `application_name`=%s
+                        UNION
+                        SELECT `build_id`
+                        FROM `config_application_versions`
+                        WHERE `gamespace_id`=%s AND `application_name`=%s
+                    )
+                ORDER BY `build_id` DESC
+                LIMIT %s;
+                """, gamespace_id, application_name, build_id,
+                gamespace_id, application_name, gamespace_id, application_name, limit)
+        except DatabaseError as e:
+            raise BuildPatchError(500, e.args[1])
+
+        return sources
@@ -0,0 +1,140 @@
+
+"""
+The effective build of every application version is kept precomputed in the `config_resolved` table,
+so resolving a configuration is a primary key lookup instead of a fallback between application versions
+and the default build.
+
+A default build of the application is kept apart from any version (even an empty one), flagged with
+`application_default`, and is passed to the functions below as DEFAULT_VERSION. The table is maintained
+by the write methods of BuildApplicationsModel, within the same transaction as the change itself,
+and cleaned up by the database itself once a build is deleted.
+"""
+
+DEFAULT_VERSION = None
+
+
+# the columns ConfigBuildAdapter.dump needs
+BUILD_COLUMNS = """
+    b.`build_id`, b.`build_url`, b.`build_variants`, b.`build_content`, b.`build_content_encoding`,
+    b.`application_name`
+"""
+
+# the builds are joined by the whole key, so a build of another application (or gamespace) is never resolved
+JOIN_BUILDS = """
+    INNER JOIN `config_builds` AS b
+        ON b.`build_id`=r.`build_id` AND b.`gamespace_id`=r.`gamespace_id`
+            AND b.`application_name`=r.`application_name`
+"""
+
+
+def resolved_key(application_version):
+    """
+    :returns: a tuple of (application_default, application_version) columns of the version
+    """
+    if application_version is DEFAULT_VERSION:
+        return 1, ""
+
+    return 0, application_version
+
+
+async def set_effective_build(db, gamespace_id, application_name, application_version, build_id):
+    application_default, application_version = resolved_key(application_version)
+
+    await db.execute(
+        """
+        INSERT INTO `config_resolved`
+        (`gamespace_id`, `application_name`, `application_default`, `application_version`, `build_id`)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY
+        UPDATE `build_id`=VALUES(`build_id`);
+        """, gamespace_id, application_name, application_default, application_version, build_id)
+
+
+async def delete_effective_build(db, gamespace_id, application_name, application_version):
+    application_default, application_version = resolved_key(application_version)
+
+    await db.execute(
+        """
+        DELETE
+        FROM `config_resolved`
+        WHERE `gamespace_id`=%s AND `application_name`=%s AND `application_default`=%s
+            AND `application_version`=%s
+        LIMIT 1;
+        """, gamespace_id, application_name, application_default, application_version)
+
+
+async def populate_effective_builds(db):
+    """
+    Fills the table up from scratch, out of default builds and application versions
+    """
+    await db.execute(
+        """
+        INSERT IGNORE INTO `config_resolved`
+        (`gamespace_id`, `application_name`, `application_default`, `application_version`, `build_id`)
+        SELECT `gamespace_id`, `application_name`, %s, %s, `default_build`
+        FROM `config_applications`
+        WHERE `default_build` IS NOT NULL;
+        """, *resolved_key(DEFAULT_VERSION))
+
+    await db.execute(
+        """
+        INSERT IGNORE INTO `config_resolved`
+        (`gamespace_id`, `application_name`, `application_default`, `application_version`, `build_id`)
+        SELECT `gamespace_id`, `application_name`, 0, `application_version`, `build_id`
+        FROM `config_application_versions`;
+        """)
+
+
+async def resolve_effective_build(db, gamespace_id, application_name, application_version):
+    """
+    :returns: a build record the version resolves into, or None
+    """
+
+    # both the version itself and the default build are read off the primary key at once,
+    # the version (if configured) always sorts before the default one
+    return await db.get(
+        """
+        SELECT {0}
+        FROM `config_resolved` AS r
+        {1}
+        WHERE r.`gamespace_id`=%s AND r.`application_name`=%s
+            AND ((r.`application_default`=0 AND r.`application_version`=%s) OR r.`application_default`=1)
+        ORDER BY r.`application_default` ASC
+        LIMIT 1;
+        """.format(BUILD_COLUMNS, JOIN_BUILDS), gamespace_id, application_name, application_version)
+
+
+async def resolve_effective_builds(db, gamespace_id, keys):
+    """
+    Same as resolve_effective_build, but for a number of (application_name, application_version) pairs
+    :returns: a dict of (application_name, application_version) -> build record, missing ones are missing
+    """
+
+    pairs = " UNION ALL ".join(
+        ["SELECT %s AS `application_name`, %s AS `application_version`"] * len(keys))
+
+    args = [arg for key in keys for arg in key]
+
+    builds = await db.query(
+        """
+        SELECT p.`application_version`, r.`application_default`, {0}
+        FROM ({1}) AS p
+        INNER JOIN `config_resolved` AS r
+            ON r.`gamespace_id`=%s AND r.`application_name`=p.`application_name`
+                AND ((r.`application_default`=0 AND r.`application_version`=p.`application_version`)
+                    OR r.`application_default`=1)
+        {2};
+        """.format(BUILD_COLUMNS, pairs, JOIN_BUILDS), *args, gamespace_id)
+
+    result = {}
+
+    for build in builds:
+        application_version = build.pop("application_version")
+        application_default = build.pop("application_default")
+        key = (build["application_name"], application_version)
+
+        # a configured version takes precedence over the default build
+        if key not in result or not application_default:
+            result[key] = build
+
+    return result
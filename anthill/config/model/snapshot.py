@@ -0,0 +1,210 @@
+
+from tornado.ioloop import PeriodicCallback
+
+from anthill.common.database import DatabaseError
+
+import asyncio
+import logging
+
+
+async def record_change(db, gamespace_id, application_name):
+    """
+    Records the fact that a resolution of some application's configuration might have been changed,
+    so every snapshot (see ResolutionSnapshot) could pick it up.
+    """
+    await db.execute(
+        """
+        INSERT INTO `config_changes`
+        (`gamespace_id`, `application_name`)
+        VALUES (%s, %s);
+        """, gamespace_id, application_name)
+
+
+class ResolutionSnapshot(object):
+    """
+    Holds the effective build of every application (and every configured application version) of every
+    gamespace in memory, so a configuration could be resolved without querying anything at all.
+
+    The snapshot is loaded once, and then refreshed incrementally every `refresh_interval` seconds
+    by reading the `config_changes` log and reloading applications mentioned there. A change may be committed
+    later than the ones made after it, so every change made within the last `change_window` seconds is looked at
+    (and applied, if it has not been yet) upon every refresh.
+    """
+
+    def __init__(self, db, refresh_interval=1, change_window=60):
+        self.db = db
+        self.ready = False
+        self.last_change_id = 0
+        self.change_window = change_window
+        # ids of changes made within `change_window` seconds that are applied already
+        self.recent_change_ids = set()
+        # a load or a refresh may be requested while another one is in progress
+        self.lock = asyncio.Lock()
+        self.refresh_callback = PeriodicCallback(self.refresh, refresh_interval * 1000)
+
+        # (gamespace_id, application_name) -> (default build, {application_version: build})
+        self.applications = {}
+
+    async def start(self):
+        await self.load()
+        self.refresh_callback.start()
+
+    def stop(self):
+        self.refresh_callback.stop()
+
+    def get(self, gamespace_id, application_name, application_version):
+        """
+        Returns a build record the version of the application resolves into, or None
+        """
+        entry = self.applications.get((gamespace_id, application_name))
+
+        if entry is None:
+            return None
+
+        default_build, versions = entry
+        return versions.get(application_version, default_build)
+
+    @staticmethod
+    def __build__(builds, row):
+        build_id = row["build_id"]
+
+        if build_id is None:
+            return None
+
+        # records of the same build are shared across all application versions pointing at it
+        build = builds.get(build_id)
+
+        if build is None:
+            build = {
+                "build_id": build_id,
+                "build_url": row["build_url"],
+                "build_variants": row["build_variants"],
+                "build_content": row["build_content"],
+                "build_content_encoding": row["build_content_encoding"],
+                "application_name": row["application_name"]
+            }
+            builds[build_id] = build
+
+        return build
+
+    async def __load_applications__(self, db, where="", *args):
+        default_builds = await db.query(
+            """
+            SELECT a.`gamespace_id`, a.`application_name`,
+                b.`build_id`, b.`build_url`, b.`build_variants`, b.`build_content`, b.`build_content_encoding`
+            FROM `config_applications` AS a
+            LEFT JOIN `config_builds` AS b
+                ON b.`build_id` = a.`default_build` AND b.`gamespace_id` = a.`gamespace_id`
+                    AND b.`application_name` = a.`application_name`
+            {0};
+            """.format(where.format("a")), *args)
+
+        version_builds = await db.query(
+            """
+            SELECT v.`gamespace_id`, v.`application_name`, v.`application_version`,
+                b.`build_id`, b.`build_url`, b.`build_variants`, b.`build_content`, b.`build_content_encoding`
+            FROM `config_application_versions` AS v
+            INNER JOIN `config_builds` AS b
+                ON b.`build_id` = v.`build_id` AND b.`gamespace_id` = v.`gamespace_id`
+                    AND b.`application_name` = v.`application_name`
+            {0};
+            """.format(where.format("v")), *args)
+
+        builds = {}
+        applications = {}
+
+        for row in default_builds:
+            applications[(row["gamespace_id"], row["application_name"])] = (
+                ResolutionSnapshot.__build__(builds, row), {})
+
+        for row in version_builds:
+            key = (row["gamespace_id"], row["application_name"])
+            entry = applications.get(key)
+
+            if entry is None:
+                entry = (None, {})
+                applications[key] = entry
+
+            entry[1][row["application_version"]] = ResolutionSnapshot.__build__(builds, row)
+
+        return applications
+
+    async def load(self):
+        async with self.lock:
+            await self.__load__()
+
+    async def __load__(self):
+        try:
+            async with self.db.acquire() as db:
+                # the changes are taken before the data itself, so changes made while loading
+                # would be simply re-applied upon next refresh
+                last_change = await db.get(
+                    """
+                    SELECT MAX(`change_id`) AS `change_id`
+                    FROM `config_changes`;
+                    """)
+
+                recent_changes = await self.__recent_changes__(db, last_change["change_id"] or 0)
+                applications = await self.__load_applications__(db)
+        except DatabaseError as e:
+            logging.error("Failed to load configuration snapshot: {0}".format(e.args[1]))
+            return
+
+        self.applications = applications
+        self.last_change_id = last_change["change_id"] or 0
+        self.recent_change_ids = set(change["change_id"] for change in recent_changes)
+        self.ready = True
+
+        logging.info("Loaded configuration snapshot of {0} applications".format(len(applications)))
+
+    async def __recent_changes__(self, db, last_change_id):
+        # change ids are taken in the order the changes are made, not committed, so a change with a lower id
+        # could show up after a higher one has been seen already, hence recent changes are read over and over
+        return await db.query(
+            """
+            SELECT `change_id`, `gamespace_id`, `application_name`
+            FROM `config_changes`
+            WHERE `change_id` > %s OR `change_date` > NOW() - INTERVAL %s SECOND
+            ORDER BY `change_id` ASC;
+            """, last_change_id, self.change_window)
+
+    async def refresh(self):
+        async with self.lock:
+            if not self.ready:
+                await self.__load__()
+                return
+
+            await self.__refresh__()
+
+    async def __refresh__(self):
+        try:
+            async with self.db.acquire() as db:
+                recent_changes = await self.__recent_changes__(db, self.last_change_id)
+
+                changed = set(
+                    (change["gamespace_id"], change["application_name"])
+                    for change in recent_changes
+                    if change["change_id"] not in self.recent_change_ids)
+
+                for gamespace_id, application_name in changed:
+                    applications = await self.__load_applications__(
+                        db, "WHERE {0}.`gamespace_id`=%s AND {0}.`application_name`=%s",
+                        gamespace_id, application_name)
+
+                    key = (gamespace_id, application_name)
+                    entry = applications.get(key)
+
+                    if entry is None:
+                        self.applications.pop(key, None)
+                    else:
+                        self.applications[key] = entry
+
+        except DatabaseError as e:
+            logging.error("Failed to refresh configuration snapshot: {0}".format(e.args[1]))
+            return
+
+        # changes that have left the window are never seen again, so there's no need to remember them
+        self.recent_change_ids = set(change["change_id"] for change in recent_changes)
+
+        if recent_changes:
+            self.last_change_id = max(self.last_change_id, recent_changes[-1]["change_id"])
@@ -0,0 +1,121 @@
+
+from anthill.common.database import DatabaseError
+from anthill.common.model import Model
+from anthill.common.validate import validate
+
+import ujson
+
+
+class DeploymentTargetError(Exception):
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return str(self.code) + ": " + str(self.message)
+
+
+class NoSuchDeploymentTargetError(Exception):
+    pass
+
+
+class DeploymentTargetAdapter(object):
+    def __init__(self, data):
+        self.target_id = str(data.get("target_id"))
+        self.application_name = data.get("application_name")
+        self.target_name = data.get("target_name")
+        self.deployment_method = data.get("deployment_method")
+        self.deployment_data = data.get("deployment_data")
+
+
+class DeploymentTargetsModel(Model):
+    """
+    Mirror deployment targets of an application. Every build is deployed with the deployment method of the
+    application itself, and additionally onto every mirror target.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_setup_db(self):
+        return self.db
+
+    def get_setup_tables(self):
+        return ["config_deployment_targets"]
+
+    @validate(gamespace_id="int", application_name="str_name", target_name="str", deployment_method="str_name")
+    async def add_target(self, gamespace_id, application_name, target_name, deployment_method):
+        try:
+            target_id = await self.db.insert(
+                """
+                INSERT INTO `config_deployment_targets`
+                (`gamespace_id`, `application_name`, `target_name`, `deployment_method`, `deployment_data`)
+                VALUES (%s, %s, %s, %s, %s);
+                """, gamespace_id, application_name, target_name, deployment_method, "{}")
+        except DatabaseError as e:
+            raise DeploymentTargetError(500, e.args[1])
+
+        return target_id
+
+    @validate(gamespace_id="int", application_name="str_name", target_id="int", deployment_data="json_dict")
+    async def update_target(self, gamespace_id, application_name, target_id, deployment_data):
+        try:
+            updated = await self.db.execute(
+                """
+                UPDATE `config_deployment_targets`
+                SET `deployment_data`=%s
+                WHERE `gamespace_id`=%s AND `application_name`=%s AND `target_id`=%s
+                LIMIT 1;
+                """, ujson.dumps(deployment_data), gamespace_id, application_name, target_id)
+        except DatabaseError as e:
+            raise DeploymentTargetError(500, e.args[1])
+
+        return bool(updated)
+
+    @validate(gamespace_id="int", application_name="str_name", target_id="int")
+    async def get_target(self, gamespace_id, application_name, target_id):
+        try:
+            target = await self.db.get(
+                """
+                SELECT *
+                FROM `config_deployment_targets`
+                WHERE `gamespace_id`=%s AND `application_name`=%s AND `target_id`=%s
+                LIMIT 1;
+                """, gamespace_id, application_name, target_id)
+        except DatabaseError as e:
+            raise DeploymentTargetError(500, e.args[1])
+
+        if not target:
+            raise NoSuchDeploymentTargetError()
+
+        return DeploymentTargetAdapter(target)
+
+    @validate(gamespace_id="int", application_name="str_name")
+    async def list_targets(self, gamespace_id, application_name):
+        try:
+            targets = await self.db.query(
+                """
+                SELECT *
+                FROM `config_deployment_targets`
+                WHERE `gamespace_id`=%s AND `application_name`=%s
+                ORDER BY `target_id` ASC;
+                """, gamespace_id, application_name)
+        except DatabaseError as e:
+            raise DeploymentTargetError(500, e.args[1])
+
+        return list(map(DeploymentTargetAdapter, targets))
+
+    @validate(gamespace_id="int", application_name="str_name", target_id="int")
+    async def delete_target(self, gamespace_id, application_name, target_id):
+        try:
+            deleted = await self.db.execute(
+                """
+                DELETE
+                FROM `config_deployment_targets`
+                WHERE `gamespace_id`=%s AND `application_name`=%s AND `target_id`=%s
+                LIMIT 1;
+                """, gamespace_id, application_name, target_id)
+        except DatabaseError as e:
+            raise DeploymentTargetError(500, e.args[1])
+
+        return bool(deleted)
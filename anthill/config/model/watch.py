@@ -0,0 +1,190 @@
+
+import asyncio
+
+
+class ConfigurationWatch(object):
+    """
+    A single watch over a version of an application. Every watcher of the same version shares the same
+    future, so a change wakes all of them at once. Use with `with` statement, see ConfigurationWatchers.watch.
+    """
+
+    def __init__(self, watchers, key, application_version):
+        self.watchers = watchers
+        self.key = key
+        self.application_version = application_version
+        self.future = asyncio.Future()
+        self.count = 0
+
+    def __enter__(self):
+        self.count += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.count -= 1
+
+        if self.count == 0:
+            self.watchers.__release__(self)
+
+    async def wait(self, timeout):
+        """
+        Waits for a change
+        :returns: True if a change happened, or False if `timeout` seconds have passed
+        """
+        try:
+            # the future is shared, so one watcher giving up should not cancel it for the others
+            await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+
+class ConfigurationWatchers(object):
+    """
+    Keeps track of everyone waiting for a configuration of some version of the application to change.
+    """
+
+    def __init__(self):
+        # (gamespace_id, application_name) -> {application_version: ConfigurationWatch}
+        self.watches = {}
+
+    def watch(self, gamespace_id, application_name, application_version):
+        key = (gamespace_id, application_name)
+        versions = self.watches.setdefault(key, {})
+
+        watch = versions.get(application_version)
+
+        if watch is None:
+            watch = ConfigurationWatch(self, key, application_version)
+            versions[application_version] = watch
+
+        return watch
+
+    def __release__(self, watch):
+        versions = self.watches.get(watch.key)
+
+        if versions is None or versions.get(watch.application_version) is not watch:
+            return
+
+        del versions[watch.application_version]
+
+        if not versions:
+            del self.watches[watch.key]
+
+    def changed(self, gamespace_id, application_name, application_version=None):
+        """
+        Wakes up everyone watching the version of the application,
+        or every version of the application if `application_version` is None
+        """
+        key = (gamespace_id, application_name)
+        versions = self.watches.get(key)
+
+        if not versions:
+            return
+
+        if application_version is None:
+            watches = list(versions.values())
+            del self.watches[key]
+        else:
+            watch = versions.pop(application_version, None)
+
+            if watch is None:
+                return
+
+            watches = [watch]
+
+            if not versions:
+                del self.watches[key]
+
+        for watch in watches:
+            if not watch.future.done():
+                watch.future.set_result(True)
+
+    def count(self):
+        return sum(
+            watch.count
+            for versions in self.watches.values()
+            for watch in versions.values())
+
+
+class ConfigurationStream(object):
+    """
+    A single subscriber of configuration change events. Events are buffered up to `buffer_size`,
+    if the subscriber could not keep up, the buffer is dropped and replaced with a single RESYNC event,
+    meaning that the subscriber should resolve everything it's interested in again.
+    """
+
+    RESYNC = None
+
+    def __init__(self, gamespace_id, application_names=None, buffer_size=64):
+        self.gamespace_id = gamespace_id
+        self.application_names = set(application_names) if application_names else None
+        self.events = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+
+    def interested(self, application_name):
+        return self.application_names is None or application_name in self.application_names
+
+    def push(self, event):
+        if self.events.full():
+            while not self.events.empty():
+                self.events.get_nowait()
+                self.dropped += 1
+
+            # the event itself would be covered by the resync
+            self.events.put_nowait(ConfigurationStream.RESYNC)
+            return
+
+        self.events.put_nowait(event)
+
+    async def next(self, timeout):
+        """
+        Waits for the next event
+        :raises asyncio.TimeoutError: if there was no event within `timeout` seconds
+        """
+        return await asyncio.wait_for(self.events.get(), timeout)
+
+
+class ConfigurationStreams(object):
+    """
+    Fans out configuration change events to every subscribed stream of the gamespace.
+    """
+
+    def __init__(self, buffer_size=64):
+        self.buffer_size = buffer_size
+        # gamespace_id -> set of ConfigurationStream
+        self.streams = {}
+
+    def open(self, gamespace_id, application_names=None):
+        stream = ConfigurationStream(gamespace_id, application_names, buffer_size=self.buffer_size)
+        self.streams.setdefault(gamespace_id, set()).add(stream)
+        return stream
+
+    def close(self, stream):
+        streams = self.streams.get(stream.gamespace_id)
+
+        if streams is None:
+            return
+
+        streams.discard(stream)
+
+        if not streams:
+            del self.streams[stream.gamespace_id]
+
+    def changed(self, gamespace_id, application_name, application_version=None):
+        streams = self.streams.get(gamespace_id)
+
+        if not streams:
+            return
+
+        event = {
+            "application": application_name,
+            "version": application_version
+        }
+
+        for stream in streams:
+            if stream.interested(application_name):
+                stream.push(event)
+
+    def count(self):
+        return sum(len(streams) for streams in self.streams.values())
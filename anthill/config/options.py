@@ -66,6 +66,85 @@ define("cache_max_connections",
        group="cache",
        type=int)
 
+define("resolve_cache_ttl",
+       default=3600,
+       help="Time (in seconds) for a resolved configuration to live in the regular cache.",
+       group="cache",
+       type=int)
+
+# Local (in-process) resolution cache
+
+define("resolve_local_cache_size",
+       default=10000,
+       help="Maximum number of resolved configurations kept in memory of each process (0 to disable).",
+       group="cache",
+       type=int)
+
+define("resolve_local_cache_ttl",
+       default=10,
+       help="Time (in seconds) for a resolved configuration to live in memory of each process.",
+       group="cache",
+       type=int)
+
+define("resolve_local_cache_not_found_ttl",
+       default=5,
+       help="Time (in seconds) for a missing configuration (404) to be remembered by each process.",
+       group="cache",
+       type=int)
+
+define("gamespace_names_cache_ttl",
+       default=300,
+       help="Time (in seconds) for a gamespace name to be remembered by each process if it could not be refreshed.",
+       group="cache",
+       type=int)
+
+define("gamespace_names_refresh_interval",
+       default=60,
+       help="How often (in seconds) the gamespace names known to each process are refreshed in background.",
+       group="cache",
+       type=int)
+
+define("config_cache_max_age",
+       default=0,
+       help="Time (in seconds) for HTTP caches to keep a resolved configuration (Cache-Control max-age). "
+            "If 0, caches are required to revalidate it each time with the ETag.",
+       group="config",
+       type=int)
+
+define("watch_max_timeout",
+       default=60,
+       help="Maximum time (in seconds) a configuration watch request could be held open.",
+       group="config",
+       type=int)
+
+define("stream_buffer_size",
+       default=64,
+       help="Maximum number of configuration change events buffered for each stream subscriber. "
+            "A subscriber that cannot keep up gets a single 'resync' event instead.",
+       group="config",
+       type=int)
+
+define("stream_ping_interval",
+       default=15,
+       help="How often (in seconds) an idle configuration change stream is pinged to be kept alive.",
+       group="config",
+       type=int)
+
+# Resolution snapshot
+
+define("resolve_snapshot",
+       default=False,
+       help="Keep effective builds of every application in memory, so configurations are resolved without "
+            "any database or cache queries.",
+       group="config",
+       type=bool)
+
+define("resolve_snapshot_refresh_interval",
+       default=1,
+       help="How often (in seconds) the resolution snapshot is checked for changes.",
+       group="config",
+       type=int)
+
 # CONFIG
 
 define("data_runtime_location",
@@ -78,4 +157,165 @@ define("data_host_location",
        default="http://config-dev.anthill/download/",
        help="CONFIG content prefix URL",
        group="config",
-       type=str)
\ No newline at end of file
+       type=str)
+
+define("serve_deployed_files",
+       default=False,
+       help="Serve files deployed with the 'local' deployment method at the path of data_host_location, "
+            "so the service could act as an origin for a CDN.",
+       group="config",
+       type=bool)
+
+define("download_cache_max_age",
+       default=31536000,
+       help="Cache-Control max-age (in seconds) of files served from data_runtime_location. "
+            "Deployed files are never changed, so it could be pretty long.",
+       group="config",
+       type=int)
+
+define("payload_cache",
+       default=False,
+       help="Serve payloads of configurations at /payload/<app>/<version>, caching them under "
+            "data_runtime_location, so the node could act as a cache in front of a remote store.",
+       group="config",
+       type=bool)
+
+define("payload_cache_budget",
+       default=1073741824,
+       help="Maximum total size (in bytes) of cached payloads (shared by every process of the node), "
+            "least recently used ones are removed beyond that.",
+       group="config",
+       type=int)
+
+define("payload_cache_fetch_timeout",
+       default=60,
+       help="Timeout (in seconds) of a payload download.",
+       group="config",
+       type=int)
+
+define("max_build_size",
+       default=67108864,
+       help="Maximum size (in bytes) of a configuration being deployed (0 for no limit).",
+       group="config",
+       type=int)
+
+define("deployment_workers",
+       default=4,
+       help="Maximum number of configurations being deployed at the same time.",
+       group="config",
+       type=int)
+
+define("deployment_attempts",
+       default=5,
+       help="How many times a deployment of a configuration is attempted before giving up.",
+       group="config",
+       type=int)
+
+define("deployment_retry_delay",
+       default=5,
+       help="Delay (in seconds) before the first retry of a failed deployment, doubled after each attempt.",
+       group="config",
+       type=int)
+
+define("deployment_uploads_location",
+       default="/usr/local/anthill/config-uploads",
+       help="A folder configurations being uploaded are stored in until they are deployed.",
+       group="config",
+       type=str)
+
+define("deployment_stale_timeout",
+       default=300,
+       help="Time (in seconds) after which a configuration being uploaded or deployed by a process that is gone "
+            "is considered failed.",
+       group="config",
+       type=int)
+
+define("deployment_parallelism",
+       default=4,
+       help="Maximum number of deployment targets a single configuration is being pushed onto at the same time.",
+       group="config",
+       type=int)
+
+define("build_patches",
+       default=False,
+       help="Make binary patches from builds being served onto every new build, and offer them to clients "
+            "(requires bsdiff4).",
+       group="config",
+       type=bool)
+
+define("build_patches_sources",
+       default=4,
+       help="Maximum number of builds to make a patch from onto a new build.",
+       group="config",
+       type=int)
+
+define("build_patches_max_size",
+       default=16777216,
+       help="Builds bigger than that (in bytes) are not patched, as patching takes a lot of memory (0 for no limit).",
+       group="config",
+       type=int)
+
+define("admin_memo_ttl",
+       default=10,
+       help="How long (in seconds) an admin tool remembers app info and author names it has requested.",
+       group="cache",
+       type=int)
+
+define("builds_count_cache_ttl",
+       default=60,
+       help="How long (in seconds) to cache the number of builds of an application shown in admin tool.",
+       group="cache",
+       type=int)
+
+define("build_patches_cache_ttl",
+       default=300,
+       help="How long (in seconds) to cache a patch lookup.",
+       group="cache",
+       type=int)
+
+define("build_variants",
+       default="",
+       help="Comma-separated compressed variants to make of every build (gzip, zstd), none by default. "
+            "zstd requires zstandard.",
+       group="config",
+       type=str)
+
+define("build_variants_workers",
+       default=2,
+       help="Number of worker processes to compress builds with.",
+       group="config",
+       type=int)
+
+define("inline_max_size",
+       default=0,
+       help="Configurations no bigger than that (in bytes) are sent along with the resolution itself, "
+            "base64 encoded (and gzipped, if that helps). Disabled (0) by default, a few kilobytes are usually "
+            "worth it.",
+       group="config",
+       type=int)
+
+define("metrics",
+       default=False,
+       help="Record latencies of every stage of the resolution path and expose them at /metrics "
+            "in Prometheus text format.",
+       group="config",
+       type=bool)
+
+define("metrics_max_series",
+       default=1000,
+       help="Maximum number of series (gamespace and application combinations) of each metric, "
+            "the rest is recorded as 'other'.",
+       group="config",
+       type=int)
+
+define("metrics_allowed_networks",
+       default="127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16",
+       help="Comma-separated networks allowed to request /metrics.",
+       group="config",
+       type=str)
+
+define("profile_max_duration",
+       default=60,
+       help="Maximum duration (in seconds) of a profiling session requested through the internal API.",
+       group="config",
+       type=int)
\ No newline at end of file
@@ -0,0 +1,77 @@
+
+from tornado.ioloop import IOLoop
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import bsdiff4
+except ImportError:
+    bsdiff4 = None
+
+import tempfile
+import os
+
+
+class BuildPatcherError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class BuildPatcher(object):
+    """
+    Makes binary patches (bsdiff4) between builds. The previous build is downloaded from where it has been
+    deployed, and the diff is made on the executor, since it takes a while for big configurations.
+
+    Requires the optional 'bsdiff4' package, without it no patches are made at all.
+    """
+
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    def __init__(self, max_size, max_ratio=0.5):
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+
+    @staticmethod
+    def available():
+        return bsdiff4 is not None
+
+    @staticmethod
+    def __diff__(source, path, max_patch_size):
+        with open(path, "rb") as f:
+            target = f.read()
+
+        patch = bsdiff4.diff(source, target)
+
+        if len(patch) > max_patch_size:
+            return None
+
+        fd, patch_path = tempfile.mkstemp()
+
+        with os.fdopen(fd, "wb") as f:
+            f.write(patch)
+
+        return patch_path, len(patch)
+
+    async def make(self, source_url, source_size, path, size):
+        """
+        Makes a patch from the build deployed at `source_url` to the build at local `path`
+        :returns: a tuple of (path to a temporary file with the patch, patch size), or None if the patch
+                  would not be much smaller than the build itself. The file should be removed by the caller.
+        """
+
+        if bsdiff4 is None:
+            raise BuildPatcherError("bsdiff4 is not installed")
+
+        if self.max_size and max(size, source_size) > self.max_size:
+            return None
+
+        try:
+            response = await AsyncHTTPClient().fetch(source_url)
+        except (HTTPError, OSError) as e:
+            raise BuildPatcherError("Failed to download {0}: {1}".format(source_url, str(e)))
+
+        return await IOLoop.current().run_in_executor(
+            BuildPatcher.executor, BuildPatcher.__diff__, response.body, path, int(size * self.max_ratio))
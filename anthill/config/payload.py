@@ -0,0 +1,243 @@
+
+from tornado.ioloop import IOLoop
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from concurrent.futures import ThreadPoolExecutor
+
+from . model.cache import SingleFlight
+from . upload import BuildUpload, BuildUploadError
+
+import asyncio
+import logging
+import fcntl
+import time
+import os
+
+
+class PayloadCacheError(Exception):
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return str(self.code) + ": " + str(self.message)
+
+
+class PayloadCache(object):
+    """
+    A pull-through disk cache of build payloads, for builds deployed onto a remote store.
+
+    A payload is downloaded from the build url once per node, and stored in `directory` under the build id.
+    Processes of the node share the directory: concurrent requests for the same build share the same
+    download within a process, and a lock file of the build (see __lock__) makes sure only one process
+    downloads it. Payloads of builds never change, so a stored one is good forever, until it's evicted:
+    the least recently used payloads of the directory are removed once their total size grows beyond
+    `budget` bytes (see __evict__).
+    """
+
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    # how often a process checks whether another one has done downloading a payload
+    LOCK_POLL_INTERVAL = 0.1
+
+    def __init__(self, directory, budget, max_size=0, fetch_timeout=60, buffer_size=1048576):
+        self.directory = directory
+        self.budget = budget
+        self.max_size = max_size
+        self.fetch_timeout = fetch_timeout
+        self.buffer_size = buffer_size
+        self.flights = SingleFlight()
+
+        # as of the last eviction, by any process
+        self.payloads = 0
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # payloads that survived a restart are still good
+        self.__evict__()
+
+    def __evict__(self, keep=None):
+        # processes take turns, so a payload is never counted (or removed) twice
+        with open(os.path.join(self.directory, ".evict.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            found = []
+
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                if name.isdigit():
+                    found.append((stat.st_mtime, name, stat.st_size))
+                elif name.startswith("upload_") and stat.st_mtime < time.time() - self.fetch_timeout * 2:
+                    # a leftover of a process that has exited in the middle of a download
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+            size = sum(payload_size for _, _, payload_size in found)
+            evicted = 0
+
+            # the modification time of a payload is updated upon every access (see get)
+            for _, name, payload_size in sorted(found):
+                if size <= self.budget:
+                    break
+
+                if name == keep:
+                    continue
+
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+
+                size -= payload_size
+                evicted += 1
+
+            self.payloads = len(found) - evicted
+            self.size = size
+            self.evictions += evicted
+
+    def __lock__(self, build_id):
+        """
+        :returns: an open lock file of the build, or None if another process holds it
+        """
+        lock = open(os.path.join(self.directory, ".{0}.lock".format(build_id)), "a")
+
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+
+        return lock
+
+    async def __fetch__(self, build_id, url):
+        deadline = time.monotonic() + self.fetch_timeout * 2
+
+        while True:
+            lock = self.__lock__(build_id)
+
+            if lock is not None:
+                break
+
+            if time.monotonic() > deadline:
+                raise PayloadCacheError(504, "Timeout waiting for payload to be downloaded")
+
+            await asyncio.sleep(PayloadCache.LOCK_POLL_INTERVAL)
+
+        try:
+            # another process might have been downloading it
+            if os.path.isfile(os.path.join(self.directory, build_id)):
+                return
+
+            size = await self.__download__(build_id, url)
+        finally:
+            # whoever waits on the removed file still gets the lock, and finds the payload stored
+            try:
+                os.remove(lock.name)
+            except OSError:
+                pass
+
+            lock.close()
+
+        logging.info("Cached payload of build {0} ({1} bytes)".format(build_id, size))
+
+        await IOLoop.current().run_in_executor(PayloadCache.executor, self.__evict__, build_id)
+
+    async def __download__(self, build_id, url):
+        """
+        Streams the payload into a temporary file, renamed into place once complete
+        :returns: a size of the payload
+        """
+
+        upload = BuildUpload(self.max_size, directory=self.directory, buffer_size=self.buffer_size)
+        writes = [None]
+        received = [0]
+
+        async def write(previous, chunk):
+            # chunks are written in order they are received, one at a time
+            if previous is not None:
+                await previous
+
+            await upload.write(chunk)
+
+        def receive(chunk):
+            received[0] += len(chunk)
+
+            if self.max_size and received[0] > self.max_size:
+                # aborts the download, instead of receiving the rest of it for nothing
+                raise PayloadCacheError(502, "Payload is too big")
+
+            writes[0] = asyncio.ensure_future(write(writes[0], chunk))
+
+        try:
+            try:
+                await AsyncHTTPClient().fetch(url, request_timeout=self.fetch_timeout, streaming_callback=receive)
+            except PayloadCacheError:
+                raise
+            except (HTTPError, OSError) as e:
+                if self.max_size and received[0] > self.max_size:
+                    raise PayloadCacheError(502, "Payload is too big")
+                raise PayloadCacheError(502, "Failed to download payload: {0}".format(str(e)))
+
+            try:
+                if writes[0] is not None:
+                    await writes[0]
+
+                path = await upload.complete()
+                os.rename(path, os.path.join(self.directory, build_id))
+            except (BuildUploadError, OSError) as e:
+                raise PayloadCacheError(500, "Failed to store payload: {0}".format(str(e)))
+        except PayloadCacheError:
+            if writes[0] is not None:
+                # noinspection PyBroadException
+                try:
+                    await writes[0]
+                except Exception:
+                    pass
+
+            await upload.release()
+            raise
+
+        return upload.size
+
+    async def get(self, build):
+        """
+        Makes sure the payload of the build is stored locally
+        :returns: a name of the payload file within the directory
+        """
+
+        build_id = build.build_id
+
+        try:
+            # marks the payload as recently used for every process, see __evict__
+            os.utime(os.path.join(self.directory, build_id))
+        except OSError:
+            pass
+        else:
+            self.hits += 1
+            return build_id
+
+        self.misses += 1
+        await self.flights.run(build_id, self.__fetch__, build_id, build.url)
+        return build_id
+
+    def stats(self):
+        return {
+            "payloads": self.payloads,
+            "size": self.size,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,176 @@
+
+from tornado.ioloop import IOLoop
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+
+from anthill.common import clamp
+
+import tracemalloc
+import threading
+import asyncio
+import logging
+import time
+import sys
+import os
+
+
+class ProfilerError(Exception):
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return str(self.code) + ": " + str(self.message)
+
+
+def collapse(frame):
+    """
+    Turns the stack of a frame into a line of collapsed stack format (outermost frame first),
+    as understood by flamegraph.pl, speedscope and the like
+    """
+    stack = []
+
+    while frame is not None:
+        code = frame.f_code
+        stack.append("{0} ({1}:{2})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+
+    stack.reverse()
+    return ";".join(stack)
+
+
+class StackSampler(object):
+    """
+    Samples the stack of a thread every `interval` seconds from another thread, so the thread being profiled
+    is not slowed down by tracing every call (like cProfile does), only by the sampling itself holding the GIL.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+
+    def run(self, duration):
+        deadline = time.monotonic() + duration
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+
+            del frame
+            time.sleep(self.interval)
+
+    def report(self):
+        return "\n".join(
+            "{0} {1}".format(stack, count)
+            for stack, count in self.stacks.most_common())
+
+
+class ProcessProfiler(object):
+    """
+    Profiles the running process on demand, for a limited time (see InternalHandler.profile
+    and InternalHandler.trace_allocations). Nothing is being done (or even started) unless requested,
+    and only one session may run at a time.
+    """
+
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    # bounds of what sample and trace_allocations are asked for
+    MIN_INTERVAL = 0.001
+    MAX_LIMIT = 100
+    MAX_FRAMES = 25
+
+    def __init__(self, max_duration=60):
+        self.max_duration = max_duration
+        self.busy = False
+
+    def __check__(self, duration):
+        if duration <= 0 or duration > self.max_duration:
+            raise ProfilerError(400, "Duration should be within (0, {0}] seconds".format(self.max_duration))
+
+        if self.busy:
+            raise ProfilerError(409, "Another profiling session is in progress")
+
+    async def sample(self, duration, interval=0.005):
+        """
+        Samples stacks of the IOLoop thread for `duration` seconds
+        :returns: a dict with the stacks in collapsed stack format, the most frequent first
+        """
+        self.__check__(duration)
+
+        if interval <= 0 or interval >= duration:
+            raise ProfilerError(400, "Interval should be within (0, duration)")
+
+        # sampling more often would keep the GIL away from the thread being profiled
+        interval = max(interval, ProcessProfiler.MIN_INTERVAL)
+
+        sampler = StackSampler(threading.get_ident(), interval)
+
+        self.busy = True
+        logging.warning("Sampling stacks for {0} seconds".format(duration))
+
+        try:
+            await IOLoop.current().run_in_executor(ProcessProfiler.executor, sampler.run, duration)
+        finally:
+            self.busy = False
+
+        return {
+            "duration": duration,
+            "interval": interval,
+            "samples": sampler.samples,
+            "stacks": sampler.report()
+        }
+
+    async def trace_allocations(self, duration, limit=20, frames=10):
+        """
+        Traces memory allocations for `duration` seconds
+        :returns: a dict with `limit` places that allocated the most of the memory still in use by the end
+        """
+        self.__check__(duration)
+
+        # both cost memory (and time to take a snapshot) of the process being profiled
+        limit = clamp(limit, 1, ProcessProfiler.MAX_LIMIT)
+        frames = clamp(frames, 1, ProcessProfiler.MAX_FRAMES)
+
+        # tracing could be enabled from the start (PYTHONTRACEMALLOC), in which case it's left that way
+        was_tracing = tracemalloc.is_tracing()
+
+        self.busy = True
+        logging.warning("Tracing allocations for {0} seconds".format(duration))
+
+        try:
+            if not was_tracing:
+                tracemalloc.start(frames)
+
+            await asyncio.sleep(duration)
+
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+
+            self.busy = False
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+        return {
+            "duration": duration,
+            "current": current,
+            "peak": peak,
+            "top": [
+                {
+                    "size": statistic.size,
+                    "count": statistic.count,
+                    "traceback": statistic.traceback.format()
+                }
+                for statistic in snapshot.statistics("traceback")[:limit]
+            ]
+        }
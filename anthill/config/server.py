@@ -8,29 +8,138 @@ from anthill.common.options import options
 
 from . model.builds import BuildsModel
 from . model.apps import BuildApplicationsModel
+from . model.cache import ResolvedConfigurationCache, LocalCache
+from . model.gamespaces import GamespaceNamesCache
+from . model.snapshot import ResolutionSnapshot
+from . model.targets import DeploymentTargetsModel
+from . model.patches import BuildPatchesModel
+from . deploy import DeploymentQueue
+from . patch import BuildPatcher
+from . compress import BuildCompressor
+from . payload import PayloadCache
+from . loader import AdminDataLoader
+from . metrics import ResolutionMetrics
+from . profiler import ProcessProfiler
+
+from urllib.parse import urlparse
+
+import logging
+import os
+import re
 
 
 class ConfigServer(server.Server):
     def __init__(self):
         super(ConfigServer, self).__init__()
 
-        db = database.Database(
+        db = self.create_database()
+        self.cache = self.create_cache()
+
+        self.resolved = ResolvedConfigurationCache(
+            self.cache,
+            LocalCache(
+                max_size=options.resolve_local_cache_size,
+                ttl=options.resolve_local_cache_ttl),
+            ttl=options.resolve_cache_ttl,
+            not_found_ttl=options.resolve_local_cache_not_found_ttl)
+
+        self.gamespaces = self.create_gamespaces(self.cache)
+
+        if options.resolve_snapshot:
+            snapshot = ResolutionSnapshot(db, refresh_interval=options.resolve_snapshot_refresh_interval)
+        else:
+            snapshot = None
+
+        self.metrics = ResolutionMetrics(enabled=options.metrics, max_series=options.metrics_max_series)
+        self.profiler = ProcessProfiler(max_duration=options.profile_max_duration)
+
+        self.metrics.add_stats(
+            "config_resolution_local_cache", "Resolved configurations cached in memory of the process",
+            self.resolved.local.stats, counters=("hits", "misses", "evictions"))
+
+        self.builds = BuildsModel(db, self.cache, self.resolved, count_ttl=options.builds_count_cache_ttl)
+        self.targets = DeploymentTargetsModel(db)
+        self.admin_loader = AdminDataLoader(self.cache, ttl=options.admin_memo_ttl)
+        self.patches = BuildPatchesModel(db, self.cache, ttl=options.build_patches_cache_ttl)
+        self.apps = BuildApplicationsModel(
+            db, self.cache, self.resolved, self.gamespaces,
+            snapshot=snapshot, stream_buffer_size=options.stream_buffer_size, metrics=self.metrics)
+
+        self.metrics.add_stats(
+            "config_resolution_flights", "Resolutions of configurations missing in the caches, coalesced by key",
+            self.apps.resolve_flights.stats, counters=("calls", "coalesced"))
+
+        if not options.build_patches:
+            patcher = None
+        elif BuildPatcher.available():
+            patcher = BuildPatcher(max_size=options.build_patches_max_size)
+        else:
+            logging.warning("bsdiff4 is not installed, build patches are disabled")
+            patcher = None
+
+        if options.build_variants:
+            compressor = BuildCompressor(
+                options.build_variants.split(","),
+                workers=options.build_variants_workers)
+        else:
+            compressor = None
+
+        if options.payload_cache:
+            self.payloads = PayloadCache(
+                os.path.join(options.data_runtime_location, ".payloads"),
+                budget=options.payload_cache_budget,
+                max_size=options.max_build_size,
+                fetch_timeout=options.payload_cache_fetch_timeout)
+
+            self.metrics.add_stats(
+                "config_payload_cache", "Payloads of builds cached on disk by the process",
+                self.payloads.stats, counters=("hits", "misses", "evictions"))
+        else:
+            self.payloads = None
+
+        self.deployments = DeploymentQueue(
+            self.builds, self.apps,
+            workers=options.deployment_workers,
+            max_attempts=options.deployment_attempts,
+            retry_delay=options.deployment_retry_delay,
+            parallelism=options.deployment_parallelism,
+            patches=self.patches,
+            patcher=patcher,
+            patch_sources=options.build_patches_sources,
+            compressor=compressor,
+            inline_max_size=options.inline_max_size,
+            uploads_location=options.deployment_uploads_location,
+            stale_timeout=options.deployment_stale_timeout)
+
+    # the storages and services the server depends on are created separately,
+    # so they could be replaced with local stand-ins (see benchmarks/read_path.py)
+
+    # noinspection PyMethodMayBeStatic
+    def create_database(self):
+        return database.Database(
             host=options.db_host,
             database=options.db_name,
             user=options.db_username,
             password=options.db_password)
 
-        self.cache = keyvalue.KeyValueStorage(
+    # noinspection PyMethodMayBeStatic
+    def create_cache(self):
+        return keyvalue.KeyValueStorage(
             host=options.cache_host,
             port=options.cache_port,
             db=options.cache_db,
             max_connections=options.cache_max_connections)
 
-        self.builds = BuildsModel(db)
-        self.apps = BuildApplicationsModel(db, self.cache)
+    # noinspection PyMethodMayBeStatic
+    def create_gamespaces(self, cache, login_client=None):
+        return GamespaceNamesCache(
+            cache,
+            ttl=options.gamespace_names_cache_ttl,
+            refresh_interval=options.gamespace_names_refresh_interval,
+            login_client=login_client)
 
     def get_models(self):
-        return [self.builds, self.apps]
+        return [self.builds, self.apps, self.targets, self.patches, self.deployments]
 
     def get_admin(self):
         return {
@@ -39,6 +148,7 @@ class ConfigServer(server.Server):
             "app": admin.ApplicationController,
             "deploy_build": admin.DeployBuildController,
             "app_settings": admin.ApplicationSettingsController,
+            "deployment_target": admin.DeploymentTargetController,
             "app_version": admin.ApplicationVersionController
         }
 
@@ -53,10 +163,39 @@ class ConfigServer(server.Server):
         }
 
     def get_handlers(self):
-        return [
-            (r"/config/(.*)/(.*)", h.ConfigGetHandler)
+        handlers = [
+            # takes precedence over the one the server registers itself
+            (r"/@admin_upload", h.AdminUploadHandler),
+            (r"/config/(.*)/(.*)", h.ConfigGetHandler),
+            (r"/watch/(.*)/(.*)", h.ConfigWatchHandler),
+            (r"/stream", h.ConfigStreamHandler),
+            (r"/configs", h.ConfigsGetHandler)
         ]
 
+        if self.metrics.enabled:
+            handlers.append((r"/metrics", h.MetricsHandler, {
+                "allowed_networks": options.metrics_allowed_networks
+            }))
+
+        if self.payloads:
+            handlers.append((r"/payload/(.*)/(.*)", h.PayloadHandler, {
+                "path": self.payloads.directory
+            }))
+
+        if options.serve_deployed_files:
+            # files deployed with the 'local' deployment method are served at data_host_location
+            prefix = urlparse(options.data_host_location).path.rstrip("/")
+
+            if prefix:
+                handlers.append((re.escape(prefix) + r"/(.+)", h.DownloadHandler, {
+                    "path": options.data_runtime_location
+                }))
+            else:
+                # served at the root, the files would shadow every other route of the service
+                logging.error("data_host_location has no path, deployed files are not served")
+
+        return handlers
+
 
 if __name__ == "__main__":
     stt = server.init()
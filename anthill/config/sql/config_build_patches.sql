@@ -0,0 +1,12 @@
+CREATE TABLE `config_build_patches` (
+  `build_id` int(11) unsigned NOT NULL,
+  `source_build_id` int(11) unsigned NOT NULL,
+  `gamespace_id` int(11) unsigned NOT NULL,
+  `application_name` varchar(64) NOT NULL DEFAULT '',
+  `patch_url` varchar(255) NOT NULL DEFAULT '',
+  `patch_size` int(11) unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`build_id`,`source_build_id`),
+  KEY `source_build_id` (`source_build_id`),
+  CONSTRAINT `config_build_patches_ibfk_1` FOREIGN KEY (`build_id`) REFERENCES `config_builds` (`build_id`) ON DELETE CASCADE,
+  CONSTRAINT `config_build_patches_ibfk_2` FOREIGN KEY (`source_build_id`) REFERENCES `config_builds` (`build_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
@@ -6,6 +6,18 @@ CREATE TABLE `config_builds` (
   `build_date` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `build_comment` varchar(255) NOT NULL DEFAULT '',
   `build_author` int(10) unsigned NOT NULL,
+  `build_hash` char(64) DEFAULT NULL,
+  `build_size` int(11) unsigned NOT NULL DEFAULT '0',
+  `build_status` enum('pending','deploying','ready','failed') NOT NULL DEFAULT 'pending',
+  `build_attempts` int(11) unsigned NOT NULL DEFAULT '0',
+  `build_error` varchar(255) NOT NULL DEFAULT '',
+  `build_mirrors` json DEFAULT NULL,
+  `build_variants` json DEFAULT NULL,
+  `build_content` mediumtext,
+  `build_content_encoding` varchar(16) DEFAULT NULL,
+  `build_heartbeat` datetime DEFAULT NULL,
   PRIMARY KEY (`build_id`),
-  KEY `gamespace_id` (`gamespace_id`,`application_name`)
+  KEY `gamespace_id` (`gamespace_id`,`application_name`,`build_id`),
+  KEY `build_hash` (`gamespace_id`,`application_name`,`build_hash`),
+  KEY `build_status` (`build_status`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
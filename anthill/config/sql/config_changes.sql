@@ -0,0 +1,8 @@
+CREATE TABLE `config_changes` (
+  `change_id` int(11) unsigned NOT NULL AUTO_INCREMENT,
+  `gamespace_id` int(11) unsigned NOT NULL,
+  `application_name` varchar(64) NOT NULL DEFAULT '',
+  `change_date` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`change_id`),
+  KEY `change_date` (`change_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
@@ -0,0 +1,5 @@
+CREATE EVENT `config_changes_cleanup`
+ON SCHEDULE EVERY 1 HOUR
+DO
+  DELETE FROM `config_changes`
+  WHERE `change_date` < NOW() - INTERVAL 1 DAY;
\ No newline at end of file
@@ -0,0 +1,10 @@
+CREATE TABLE `config_deployment_targets` (
+  `target_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `gamespace_id` int(10) unsigned NOT NULL,
+  `application_name` varchar(255) NOT NULL DEFAULT '',
+  `target_name` varchar(64) NOT NULL DEFAULT '',
+  `deployment_method` varchar(64) NOT NULL DEFAULT '',
+  `deployment_data` json NOT NULL,
+  PRIMARY KEY (`target_id`),
+  KEY `application_name` (`gamespace_id`,`application_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
@@ -0,0 +1,10 @@
+CREATE TABLE `config_resolved` (
+  `gamespace_id` int(11) unsigned NOT NULL,
+  `application_name` varchar(64) NOT NULL DEFAULT '',
+  `application_default` tinyint(1) NOT NULL DEFAULT '0',
+  `application_version` varchar(64) NOT NULL DEFAULT '',
+  `build_id` int(11) unsigned NOT NULL,
+  PRIMARY KEY (`gamespace_id`,`application_name`,`application_default`,`application_version`),
+  KEY `build_id` (`build_id`),
+  CONSTRAINT `config_resolved_ibfk_1` FOREIGN KEY (`build_id`) REFERENCES `config_builds` (`build_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
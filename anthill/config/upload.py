@@ -0,0 +1,120 @@
+
+from tornado.ioloop import IOLoop
+from concurrent.futures import ThreadPoolExecutor
+
+import tempfile
+import hashlib
+import os
+
+
+class BuildUploadError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class BuildUpload(object):
+    """
+    Receives an uploaded build into a temporary file.
+
+    Chunks are collected into a buffer of `buffer_size` bytes, which is then hashed (SHA-256) and written
+    in binary mode on the executor, so the IOLoop is never blocked by the disk. While one buffer is being
+    written, the next one is being received, but no more than that: a write should complete before
+    another one is started, so the memory taken by the upload stays bounded.
+    """
+
+    executor = ThreadPoolExecutor(max_workers=4)
+
+    def __init__(self, max_size, directory=None, buffer_size=1048576):
+        self.max_size = max_size
+        self.buffer_size = buffer_size
+
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix="upload_")
+        self.f = os.fdopen(fd, "wb")
+
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+        self.buffer = []
+        self.buffered = 0
+        self.pending = None
+
+    def __write__(self, data):
+        self.hash.update(data)
+        self.f.write(data)
+
+    async def __flush__(self):
+        if self.pending is not None:
+            await self.pending
+            self.pending = None
+
+        if not self.buffer:
+            return
+
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+
+        self.pending = IOLoop.current().run_in_executor(BuildUpload.executor, self.__write__, data)
+
+    async def write(self, chunk):
+        self.size += len(chunk)
+
+        if self.max_size and self.size > self.max_size:
+            raise BuildUploadError("Configuration is too big (maximum is {0} bytes)".format(self.max_size))
+
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+
+        if self.buffered >= self.buffer_size:
+            await self.__flush__()
+
+    async def complete(self):
+        """
+        Writes everything left and closes the file
+        :returns: a path to the complete file
+        """
+
+        await self.__flush__()
+
+        if self.pending is not None:
+            await self.pending
+            self.pending = None
+
+        self.f.close()
+        return self.path
+
+    def touch(self):
+        # see DeploymentQueue.__remove_orphans__
+        try:
+            os.utime(self.path)
+        except OSError:
+            pass
+
+    @property
+    def sha256(self):
+        return self.hash.hexdigest()
+
+    async def release(self):
+        """
+        Removes the temporary file. Should be called in any case once the upload is no longer needed.
+        """
+
+        if self.pending is not None:
+            # noinspection PyBroadException
+            try:
+                await self.pending
+            except Exception:
+                pass
+
+            self.pending = None
+
+        if not self.f.closed:
+            self.f.close()
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
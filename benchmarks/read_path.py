@@ -0,0 +1,567 @@
+"""
+Load tests the configuration read path: `ConfigGetHandler` over HTTP, and `InternalHandler.get_configuration`
+called directly (the way a request of another service ends up being processed, minus the message broker).
+
+The server runs in this very process against local stand-ins only, so no MySQL, Redis or login service
+is needed: the database is an in-memory SQLite one (the real resolution queries are run on it), the key/value
+storage is a dict, and gamespace names are resolved by a stub. Round trips to the real storages are simulated
+with --db-latency and --cache-latency, so a cold cache costs what it would.
+
+The results are printed as JSON, so they could be stored and compared across commits:
+
+    python benchmarks/read_path.py --distribution=zipf --concurrency=64 > read_path.json
+    python benchmarks/read_path.py --cache=cold --target=internal
+"""
+
+from anthill.common.options import options
+from anthill.common.database import DatabaseError
+from anthill.config.server import ConfigServer
+from anthill.config.model.resolution import populate_effective_builds
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.ioloop import IOLoop
+
+import subprocess
+import itertools
+import argparse
+import logging
+import asyncio
+import sqlite3
+import random
+import time
+import json
+
+
+SCHEMA = """
+CREATE TABLE `config_builds` (
+  `build_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `gamespace_id` INTEGER NOT NULL,
+  `application_name` TEXT NOT NULL,
+  `build_url` TEXT,
+  `build_variants` TEXT,
+  `build_content` TEXT,
+  `build_content_encoding` TEXT
+);
+CREATE TABLE `config_applications` (
+  `gamespace_id` INTEGER NOT NULL,
+  `application_name` TEXT NOT NULL,
+  `default_build` INTEGER,
+  PRIMARY KEY (`gamespace_id`, `application_name`)
+);
+CREATE TABLE `config_application_versions` (
+  `gamespace_id` INTEGER NOT NULL,
+  `application_name` TEXT NOT NULL,
+  `application_version` TEXT NOT NULL,
+  `build_id` INTEGER NOT NULL,
+  PRIMARY KEY (`gamespace_id`, `application_name`, `application_version`)
+);
+CREATE TABLE `config_resolved` (
+  `gamespace_id` INTEGER NOT NULL,
+  `application_name` TEXT NOT NULL,
+  `application_default` INTEGER NOT NULL DEFAULT 0,
+  `application_version` TEXT NOT NULL,
+  `build_id` INTEGER NOT NULL,
+  PRIMARY KEY (`gamespace_id`, `application_name`, `application_default`, `application_version`)
+);
+CREATE TABLE `config_changes` (
+  `change_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `gamespace_id` INTEGER NOT NULL,
+  `application_name` TEXT NOT NULL,
+  `change_date` TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class SQLiteDatabase(object):
+    """
+    Implements the part of anthill.common.database.Database the read path uses, on top of in-memory SQLite.
+    MySQL-only statements (like ON DUPLICATE KEY) are not supported, so the data is inserted directly.
+    """
+
+    def __init__(self, latency=0):
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.latency = latency
+        self.queries = 0
+
+    async def __execute__(self, query, args):
+        self.queries += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        try:
+            query = query.replace("NOW() - INTERVAL %s SECOND", "datetime('now', '-' || %s || ' seconds')")
+            return self.connection.execute(query.replace("%s", "?"), args)
+        except sqlite3.Error as e:
+            raise DatabaseError(500, str(e))
+
+    async def get(self, query, *args):
+        row = (await self.__execute__(query, args)).fetchone()
+        return dict(row) if row is not None else None
+
+    async def query(self, query, *args):
+        return tuple(dict(row) for row in (await self.__execute__(query, args)).fetchall())
+
+    async def execute(self, query, *args):
+        return (await self.__execute__(query, args)).rowcount
+
+    async def insert(self, query, *args):
+        return (await self.__execute__(query, args)).lastrowid
+
+    async def commit(self):
+        self.connection.commit()
+
+    async def rollback(self):
+        self.connection.rollback()
+
+    def acquire(self, auto_commit=True):
+        return SQLiteDatabase.Connection(self)
+
+    class Connection(object):
+        def __init__(self, db):
+            self.db = db
+
+        async def __aenter__(self):
+            return self.db
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+
+class FakeKeyValueStorage(object):
+    """
+    Implements the part of anthill.common.keyvalue.KeyValueStorage the read path (and invalidations) use,
+    on top of a dict. Expiration is ignored, a benchmark does not run for that long anyway.
+    """
+
+    def __init__(self, latency=0):
+        self.values = {}
+        self.channels = {}
+        self.latency = latency
+        self.round_trips = 0
+
+    async def __round_trip__(self):
+        self.round_trips += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def flush(self):
+        self.values.clear()
+
+    def acquire(self):
+        return FakeKeyValueStorage.Connection(self)
+
+    class Connection(object):
+        def __init__(self, storage):
+            self.storage = storage
+            self.values = storage.values
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+        async def get(self, key):
+            await self.storage.__round_trip__()
+            return self.values.get(key)
+
+        async def mget(self, key, *keys):
+            await self.storage.__round_trip__()
+            return [self.values.get(k) for k in (key,) + keys]
+
+        async def set(self, key, value, expire=0):
+            await self.storage.__round_trip__()
+            self.values[key] = value
+
+        async def setex(self, key, seconds, value):
+            await self.set(key, value)
+
+        async def delete(self, key, *keys):
+            await self.storage.__round_trip__()
+
+            for k in (key,) + keys:
+                self.values.pop(k, None)
+
+        async def expire(self, key, timeout):
+            await self.storage.__round_trip__()
+
+        async def hget(self, key, field):
+            await self.storage.__round_trip__()
+            return self.values.get(key, {}).get(field)
+
+        async def hset(self, key, field, value):
+            await self.storage.__round_trip__()
+            self.values.setdefault(key, {})[field] = value
+
+        async def hdel(self, key, field, *fields):
+            await self.storage.__round_trip__()
+
+            for f in (field,) + fields:
+                self.values.get(key, {}).pop(f, None)
+
+        async def publish_json(self, channel, obj):
+            await self.storage.__round_trip__()
+
+            for subscriber in self.storage.channels.get(channel, []):
+                subscriber.messages.put_nowait(obj)
+
+        async def subscribe(self, channel):
+            await self.storage.__round_trip__()
+
+            subscriber = FakeKeyValueStorage.Channel()
+            self.storage.channels.setdefault(channel, []).append(subscriber)
+            return [subscriber]
+
+        def pipeline(self):
+            return FakeKeyValueStorage.Batch(self)
+
+        def multi_exec(self):
+            return FakeKeyValueStorage.Batch(self)
+
+    class Channel(object):
+        def __init__(self):
+            self.messages = asyncio.Queue()
+            self.message = None
+
+        async def wait_message(self):
+            self.message = await self.messages.get()
+            return True
+
+        async def get_json(self):
+            return self.message
+
+    class Batch(object):
+        """
+        Commands of a pipeline (or a transaction) are applied all at once, within a single round trip
+        """
+
+        def __init__(self, connection):
+            self.connection = connection
+            self.commands = []
+
+        def __getattr__(self, name):
+            def command(*args, **kwargs):
+                self.commands.append((name, args, kwargs))
+
+            return command
+
+        async def execute(self):
+            await self.connection.storage.__round_trip__()
+
+            values = self.connection.values
+            results = []
+
+            for name, args, kwargs in self.commands:
+                if name == "eval":
+                    # the only script there is, see ResolvedConfigurationCache.SET_SCRIPT
+                    (generation_key, key), (generation, _, *fields) = kwargs["keys"], kwargs["args"]
+
+                    if str(values.get(generation_key) or 0) != generation:
+                        results.append(0)
+                        continue
+
+                    values.setdefault(key, {}).update(zip(fields[0::2], fields[1::2]))
+                    results.append(1)
+                elif name == "incr":
+                    key, = args
+                    values[key] = int(values.get(key) or 0) + 1
+                    results.append(values[key])
+                elif name == "hget":
+                    key, field = args
+                    results.append(values.get(key, {}).get(field))
+                elif name == "hset":
+                    key, field, value = args
+                    values.setdefault(key, {})[field] = value
+                    results.append(1)
+                elif name == "hdel":
+                    key, *fields = args
+                    hash_values = values.get(key, {})
+                    results.append(sum(1 for field in fields if hash_values.pop(field, None) is not None))
+                elif name == "delete":
+                    results.append(sum(1 for key in args if values.pop(key, None) is not None))
+                elif name == "expire":
+                    # expiration is ignored, see above
+                    key, _ = args
+                    results.append(int(key in values))
+                else:
+                    raise NotImplementedError("Command '{0}' is not supported".format(name))
+
+            return results
+
+
+class StubGamespace(object):
+    def __init__(self, gamespace_id):
+        self.gamespace_id = gamespace_id
+
+
+class StubLoginClient(object):
+    """
+    Resolves gamespace names of the benchmark dataset (gs1, gs2, ...) without the login service
+    """
+
+    async def find_gamespace(self, gamespace_name):
+        if not gamespace_name.startswith("gs"):
+            return None
+
+        return StubGamespace(int(gamespace_name[2:]))
+
+
+class BenchmarkConfigServer(ConfigServer):
+    def __init__(self, db, cache):
+        self.benchmark_db = db
+        self.benchmark_cache = cache
+        super(BenchmarkConfigServer, self).__init__()
+
+    def create_database(self):
+        return self.benchmark_db
+
+    def create_cache(self):
+        return self.benchmark_cache
+
+    def create_gamespaces(self, cache, login_client=None):
+        return super(BenchmarkConfigServer, self).create_gamespaces(cache, login_client=StubLoginClient())
+
+
+class SQLiteDialect(object):
+    """
+    Rewrites MySQL-only statements of the setup into the SQLite dialect
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def execute(self, query, *args):
+        return await self.db.execute(query.replace("INSERT IGNORE", "INSERT OR IGNORE"), *args)
+
+
+async def prepare(db, args):
+    """
+    :returns: a list of (gamespace_name, application_name, application_version) to request
+    """
+
+    keys = []
+
+    for gamespace_id in range(1, args.gamespaces + 1):
+        for application in range(args.applications):
+            application_name = "app{0}".format(application)
+            builds = []
+
+            for build in range(args.builds):
+                builds.append(await db.insert(
+                    """
+                    INSERT INTO `config_builds` (`gamespace_id`, `application_name`, `build_url`)
+                    VALUES (%s, %s, %s);
+                    """, gamespace_id, application_name,
+                    "http://localhost/{0}/{1}/{2}".format(gamespace_id, application_name, build)))
+
+            await db.execute(
+                """
+                INSERT INTO `config_applications` (`gamespace_id`, `application_name`, `default_build`)
+                VALUES (%s, %s, %s);
+                """, gamespace_id, application_name, builds[-1])
+
+            for version in range(args.versions):
+                application_version = "1.{0}".format(version)
+
+                await db.execute(
+                    """
+                    INSERT INTO `config_application_versions`
+                    (`gamespace_id`, `application_name`, `application_version`, `build_id`)
+                    VALUES (%s, %s, %s, %s);
+                    """, gamespace_id, application_name, application_version, random.choice(builds))
+
+            # versions requested include the ones that are not configured and resolve into the default build
+            for version in range(int(args.versions * (1 + args.unconfigured))):
+                keys.append(("gs{0}".format(gamespace_id), application_name, "1.{0}".format(version)))
+
+    await populate_effective_builds(SQLiteDialect(db))
+
+    return keys
+
+
+def make_requests(keys, args):
+    if args.distribution == "uniform":
+        return [random.choice(keys) for _ in range(args.requests)]
+
+    # zipf: a few versions are requested the most (say, the latest ones of popular games), and the rest is a long tail
+    hot = list(keys)
+    random.shuffle(hot)
+    cum_weights = list(itertools.accumulate(1.0 / (rank ** args.zipf_s) for rank in range(1, len(hot) + 1)))
+    return random.choices(hot, cum_weights=cum_weights, k=args.requests)
+
+
+def percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+
+async def drive(requests, concurrency, request):
+    latencies = []
+    errors = 0
+    pending = iter(requests)
+
+    async def worker():
+        nonlocal errors
+
+        for key in pending:
+            started = time.perf_counter()
+
+            # noinspection PyBroadException
+            try:
+                await request(*key)
+            except Exception:
+                errors += 1
+
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "elapsed": elapsed,
+        "rps": len(requests) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] * 1000
+        }
+    }
+
+
+def reset_stats(server, db, cache):
+    local = server.resolved.local
+    local.hits = local.misses = local.evictions = 0
+    server.apps.resolve_flights.calls = server.apps.resolve_flights.coalesced = 0
+    db.queries = 0
+    cache.round_trips = 0
+
+
+def collect_stats(server, db, cache):
+    return {
+        "local_cache": server.resolved.local.stats(),
+        "resolve_flights": server.apps.resolve_flights.stats(),
+        "db_queries": db.queries,
+        "cache_round_trips": cache.round_trips
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    options.resolve_snapshot = args.snapshot
+    options.payload_cache = False
+    options.build_patches = False
+    options.build_variants = ""
+
+    if args.local_cache_size is not None:
+        options.resolve_local_cache_size = args.local_cache_size
+
+    db = SQLiteDatabase()
+    cache = FakeKeyValueStorage(latency=args.cache_latency / 1000.0)
+
+    keys = await prepare(db, args)
+    requests = make_requests(keys, args)
+
+    db.latency = args.db_latency / 1000.0
+
+    # only what the read path needs is started, models are not (there's nothing to set up)
+    server = BenchmarkConfigServer(db, cache)
+
+    if server.apps.snapshot:
+        await server.apps.snapshot.start()
+
+    sock, port = bind_unused_port()
+    http_server = HTTPServer(server)
+    http_server.add_sockets([sock])
+
+    http_client = AsyncHTTPClient(force_instance=True, max_clients=args.concurrency)
+    internal_handler = server.get_internal_handler()
+    gamespace_ids = {"gs{0}".format(gamespace_id): gamespace_id for gamespace_id in range(1, args.gamespaces + 1)}
+
+    async def request_http(gamespace_name, application_name, application_version):
+        await http_client.fetch("http://127.0.0.1:{0}/config/{1}/{2}?gamespace={3}".format(
+            port, application_name, application_version, gamespace_name))
+
+    async def request_internal(gamespace_name, application_name, application_version):
+        await internal_handler.get_configuration(
+            app_name=application_name, app_version=application_version, gamespace=gamespace_ids[gamespace_name])
+
+    targets = {
+        "http": request_http,
+        "internal": request_internal
+    }
+
+    results = []
+
+    for target in (["http", "internal"] if args.target == "both" else [args.target]):
+        if args.cache == "warm":
+            await drive(keys, args.concurrency, targets[target])
+        else:
+            server.resolved.local.clear()
+            cache.flush()
+
+        reset_stats(server, db, cache)
+        result = await drive(requests, args.concurrency, targets[target])
+        result["target"] = target
+        result["stats"] = collect_stats(server, db, cache)
+        results.append(result)
+
+    http_server.stop()
+    http_client.close()
+
+    if server.apps.snapshot:
+        server.apps.snapshot.stop()
+
+    return {
+        "commit": get_commit(),
+        "parameters": vars(args),
+        "results": results
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Configuration read path benchmark")
+    parser.add_argument("--target", choices=["http", "internal", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--distribution", choices=["uniform", "zipf"], default="zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="the skew of the zipf distribution")
+    parser.add_argument("--cache", choices=["warm", "cold"], default="warm",
+                        help="warm: every version is requested once before measuring, "
+                             "cold: caches are flushed before measuring")
+    parser.add_argument("--local-cache-size", type=int, default=None,
+                        help="overrides resolve_local_cache_size (0 to measure the regular cache alone)")
+    parser.add_argument("--snapshot", action="store_true", help="resolve from the in-memory snapshot")
+    parser.add_argument("--gamespaces", type=int, default=4)
+    parser.add_argument("--applications", type=int, default=50, help="per gamespace")
+    parser.add_argument("--builds", type=int, default=10, help="per application")
+    parser.add_argument("--versions", type=int, default=20, help="configured per application")
+    parser.add_argument("--unconfigured", type=float, default=0.5,
+                        help="a share of versions requested on top of configured ones, resolving to the default build")
+    parser.add_argument("--db-latency", type=float, default=1.0, help="simulated round trip (ms)")
+    parser.add_argument("--cache-latency", type=float, default=0.2, help="simulated round trip (ms)")
+    parser.add_argument("--seed", type=int, default=0)
+
+    arguments = parser.parse_args()
+    random.seed(arguments.seed)
+
+    # every request would be logged otherwise
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(json.dumps(IOLoop.current().run_sync(lambda: main(arguments)), indent=2))
@@ -0,0 +1,182 @@
+"""
+Compares the resolution of a configuration through the precomputed `config_resolved` table against
+the former plan (a COALESCE of two correlated subqueries) on a synthetic dataset.
+
+The tables are (re)created in the given database, so please point it at a scratch one:
+
+    python benchmarks/resolution.py --db-name=config_bench --applications=2000 --lookups=20000
+"""
+
+from anthill.common.database import Database
+from anthill.config.model.resolution import populate_effective_builds, resolve_effective_build
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+
+SQL_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "anthill", "config", "sql")
+TABLES = ["config_builds", "config_applications", "config_application_versions", "config_resolved"]
+INSERT_BATCH = 1000
+
+
+async def resolve_coalesce(db, gamespace_id, application_name, application_version):
+    return await db.get(
+        """
+        SELECT b.`build_id`, b.`build_url`, b.`build_variants`, b.`build_content`, b.`build_content_encoding`,
+            b.`application_name`
+        FROM `config_builds` AS b
+        WHERE b.`gamespace_id`=%s AND b.`application_name`=%s AND b.`build_id` = COALESCE(
+            (
+                SELECT `build_id`
+                FROM `config_application_versions` AS v
+                WHERE v.`gamespace_id` = b.`gamespace_id` AND v.`application_name` = b.`application_name`
+                    AND v.`application_version`=%s
+                LIMIT 1
+            ),
+            (
+                SELECT `default_build`
+                FROM `config_applications` AS a
+                WHERE a.`gamespace_id`= b.`gamespace_id` AND a.`application_name` = b.`application_name`
+                LIMIT 1
+            )
+        )
+        LIMIT 1;
+        """, gamespace_id, application_name, application_version)
+
+
+PLANS = {
+    "coalesce": resolve_coalesce,
+    "precomputed": resolve_effective_build
+}
+
+
+async def insert_many(db, table, columns, rows):
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+
+    for i in range(0, len(rows), INSERT_BATCH):
+        batch = rows[i:i + INSERT_BATCH]
+
+        await db.execute(
+            "INSERT INTO `{0}` ({1}) VALUES {2};".format(
+                table, ", ".join("`{0}`".format(column) for column in columns), ", ".join([placeholders] * len(batch))),
+            *[value for row in batch for value in row])
+
+
+async def prepare(db, args):
+    for table in reversed(TABLES):
+        await db.execute("DROP TABLE IF EXISTS `{0}`;".format(table))
+
+    for table in TABLES:
+        with open(os.path.join(SQL_DIRECTORY, table + ".sql")) as f:
+            await db.execute(f.read())
+
+    applications = [
+        (gamespace_id, "app{0}".format(application))
+        for gamespace_id in range(1, args.gamespaces + 1)
+        for application in range(args.applications // args.gamespaces)
+    ]
+
+    builds = [
+        (gamespace_id, application_name, "http://localhost/{0}/{1}".format(application_name, build), 1, "ready")
+        for gamespace_id, application_name in applications
+        for build in range(args.builds)
+    ]
+
+    print("Inserting {0} builds...".format(len(builds)))
+    await insert_many(db, "config_builds",
+                      ["gamespace_id", "application_name", "build_url", "build_author", "build_status"], builds)
+
+    application_builds = {}
+
+    for row in await db.query("SELECT `build_id`, `gamespace_id`, `application_name` FROM `config_builds`;"):
+        application_builds.setdefault((row["gamespace_id"], row["application_name"]), []).append(row["build_id"])
+
+    print("Inserting {0} applications...".format(len(applications)))
+    await insert_many(db, "config_applications",
+                      ["gamespace_id", "application_name", "deployment_data", "default_build"], [
+                          key + ("{}", max(application_builds[key]))
+                          for key in applications
+                      ])
+
+    versions = [
+        (gamespace_id, application_name, "1.{0}".format(version),
+         random.choice(application_builds[(gamespace_id, application_name)]))
+        for gamespace_id, application_name in applications
+        for version in range(args.versions)
+    ]
+
+    print("Inserting {0} application versions...".format(len(versions)))
+    await insert_many(db, "config_application_versions",
+                      ["gamespace_id", "application_name", "application_version", "build_id"], versions)
+
+    await populate_effective_builds(db)
+    return applications
+
+
+async def run(db, plan, lookups, concurrency):
+    latencies = []
+
+    async def worker(worker_lookups):
+        async with db.acquire() as connection:
+            for lookup in worker_lookups:
+                started = time.perf_counter()
+                await plan(connection, *lookup)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(lookups[i::concurrency]) for i in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    return {
+        "rps": len(lookups) / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000
+    }
+
+
+async def main(args):
+    db = Database(host=args.db_host, database=args.db_name, user=args.db_username, password=args.db_password)
+
+    if not args.skip_prepare:
+        applications = await prepare(db, args)
+    else:
+        applications = [
+            (row["gamespace_id"], row["application_name"])
+            for row in await db.query("SELECT `gamespace_id`, `application_name` FROM `config_applications`;")
+        ]
+
+    # half of the lookups are for configured versions, the other half fall back to the default build
+    lookups = [
+        random.choice(applications) + ("1.{0}".format(random.randrange(args.versions * 2)),)
+        for _ in range(args.lookups)
+    ]
+
+    for name, plan in PLANS.items():
+        # warm up the buffer pool, so both plans are measured on the same terms
+        await run(db, plan, lookups[:1000], args.concurrency)
+        result = await run(db, plan, lookups, args.concurrency)
+
+        print("{0:>12}: {1:10.1f} lookups/s, p50 {2:.3f} ms, p99 {3:.3f} ms".format(
+            name, result["rps"], result["p50"], result["p99"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Configuration resolution benchmark")
+    parser.add_argument("--db-host", default="127.0.0.1")
+    parser.add_argument("--db-name", default="config_bench")
+    parser.add_argument("--db-username", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--gamespaces", type=int, default=10)
+    parser.add_argument("--applications", type=int, default=1000, help="in total, across every gamespace")
+    parser.add_argument("--builds", type=int, default=50, help="per application")
+    parser.add_argument("--versions", type=int, default=20, help="configured per application")
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--skip-prepare", action="store_true", help="reuse the dataset from a previous run")
+
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -5,6 +5,13 @@ DEPENDENCIES = [
     "anthill-common>=0.2.5"
 ]
 
+EXTRAS = {
+    # binary patches between builds
+    "patches": ["bsdiff4"],
+    # zstd compressed variants of builds
+    "zstd": ["zstandard"]
+}
+
 setup(
     name='anthill-config',
     package_data={
@@ -20,5 +27,6 @@ setup(
     include_package_data=True,
     packages=find_namespace_packages(include=["anthill.*"]),
     zip_safe=False,
-    install_requires=DEPENDENCIES
+    install_requires=DEPENDENCIES,
+    extras_require=EXTRAS
 )